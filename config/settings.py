@@ -228,6 +228,19 @@ if USE_DJDT:
 
 PROTOCOLS_PATH = 'events/protocols'
 
+# Пересчёт только изменившегося участника при вводе результатов вместо полного пересчёта группы
+RESULTS_INCREMENTAL_UPDATE = env.bool('RESULTS_INCREMENTAL_UPDATE', default=True)
+# Движок подсчёта результатов группы: 'python' или 'numpy' (векторизованный, для больших соревнований)
+SCORING_ENGINE = env('SCORING_ENGINE', default='python')
+# Живое обновление страницы результатов через SSE (нужен ASGI-сервер для config.asgi), иначе page_reload()
+RESULTS_LIVE_PUSH = env.bool('RESULTS_LIVE_PUSH', default=False)
+# Отложенный пересчёт мест группы после внесения результата, сек (0 - сразу). Результаты, внесённые
+# за это время, пересчитываются одним проходом; свой результат участник видит сразу
+RESULTS_RECOMPUTE_DEBOUNCE = env.float('RESULTS_RECOMPUTE_DEBOUNCE', default=0)
+# Выгрузка протоколов в xlsx в write-only режиме openpyxl: строки пишутся по мере получения, память не растёт
+# с числом участников. False - прежняя выгрузка копированием листа шаблона
+XLSX_WRITE_ONLY_EXPORT = env.bool('XLSX_WRITE_ONLY_EXPORT', default=True)
+
 DEFAULT_EVENT_ID = env('DEFAULT_EVENT_ID')
 
 LOGIN_REDIRECT_URL = '/'
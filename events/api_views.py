@@ -4,6 +4,8 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from datetime import datetime
 
 from events.models import Event, Participant, Route, Wallet, PromoCode
@@ -39,6 +41,24 @@ class IsEventOwnerOrReadOnly(permissions.BasePermission):
         return obj.event.owner == request.user
 
 
+class EventResultsETagMixin:
+    """
+    Conditional GET for lists filtered by ?event=: ETag from the event results version, 304 if unchanged.
+    """
+    def list(self, request, *args, **kwargs):
+        event_id = request.query_params.get('event')
+        etag = services.get_results_etag(request=request, event_id=event_id) if event_id and event_id.isdigit() \
+            else None
+        if etag is None:
+            return super().list(request, *args, **kwargs)
+        etag = quote_etag(etag)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        response['ETag'] = etag
+        return response
+
+
 class EventViewSet(viewsets.ModelViewSet):
     serializer_class = EventSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
@@ -63,8 +83,44 @@ class EventViewSet(viewsets.ModelViewSet):
                 setattr(event, field, value)
         event.save()
 
+    @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
+    def results(self, request, pk=None):
+        """
+        Results as in services.get_results. With ?since=<version> only participants changed after that version.
+        """
+        event = self.get_object()
+        user = request.user
+        if not event.is_results_allowed and not (user.is_superuser or event.owner_id == user.id):
+            return Response({"error": "Results are not available for this event"}, status=status.HTTP_403_FORBIDDEN)
+
+        data = {'version': str(event.results_version)}
+        since = request.query_params.get('since')
+        changes = services.get_results_changes(event=event, since=since) if since else None
+        if changes is None:
+            data.update({'full': True, 'results': services.get_results_json(event=event)})
+        else:
+            data.update({'full': False, **changes})
+        return Response(data)
+
+    @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
+    def route_stats(self, request, pk=None):
+        """
+        Tops, flashes and zones per route. Optional ?gender=MALE|FEMALE and ?group_index=<n>.
+        """
+        event = self.get_object()
+        user = request.user
+        if not event.is_results_allowed and not (user.is_superuser or event.owner_id == user.id):
+            return Response({"error": "Results are not available for this event"}, status=status.HTTP_403_FORBIDDEN)
+        group_index = request.query_params.get('group_index')
+        try:
+            group_index = int(group_index) if group_index is not None else None
+        except ValueError:
+            return Response({"error": "Invalid group_index"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(services.get_route_stats(event=event, gender=request.query_params.get('gender'),
+                                                 group_index=group_index))
 
-class ParticipantViewSet(viewsets.ModelViewSet):
+
+class ParticipantViewSet(EventResultsETagMixin, viewsets.ModelViewSet):
     serializer_class = ParticipantSerializer
 
     def get_permissions(self):
@@ -200,7 +256,7 @@ class ParticipantViewSet(viewsets.ModelViewSet):
         return Response({"status": "results entered successfully"}, status=status.HTTP_200_OK)
 
 
-class RouteViewSet(viewsets.ModelViewSet):
+class RouteViewSet(EventResultsETagMixin, viewsets.ModelViewSet):
     serializer_class = RouteSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsEventOwnerOrReadOnly]
 
@@ -235,6 +291,18 @@ class RouteViewSet(viewsets.ModelViewSet):
         route = serializer.save()
         services.update_results(route.event)
 
+    @action(detail=True, methods=['get'], permission_classes=[permissions.AllowAny])
+    def leaderboard(self, request, pk=None):
+        """
+        Best results on the route: fewest attempts to top, then to zone.
+        """
+        route = self.get_object()
+        event = route.event
+        user = request.user
+        if not event.is_results_allowed and not (user.is_superuser or event.owner_id == user.id):
+            return Response({"error": "Results are not available for this event"}, status=status.HTTP_403_FORBIDDEN)
+        return Response(services.get_route_leaderboard(route=route))
+
 
 class WalletViewSet(viewsets.ModelViewSet):
     serializer_class = WalletSerializer
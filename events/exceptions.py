@@ -23,3 +23,11 @@ class ParticipantTooYoungError(Exception):
 
     def __str__(self):
         return f"Минимальный возраст участника: {self.age} лет."
+
+
+class RegistrationFullError(Exception):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args)
+
+    def __str__(self):
+        return "Свободных мест нет, регистрация закрыта."
@@ -0,0 +1,133 @@
+""" Живые результаты: одно LISTEN-подключение к PostgreSQL на event loop,
+уведомления services.notify_results_changed() раздаются SSE-потокам страниц результатов """
+import asyncio
+import json
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+
+from events import services
+from events.models import Event
+
+HEARTBEAT_INTERVAL = 15
+
+
+def _open_listen_connection():
+    db = connections['default']
+    pg_connection = db.get_new_connection(db.get_connection_params())
+    pg_connection.autocommit = True
+    with pg_connection.cursor() as cursor:
+        cursor.execute(f'LISTEN {services.RESULTS_NOTIFY_CHANNEL}')
+    return pg_connection
+
+
+class ResultsListener:
+    def __init__(self):
+        self._connection = None
+        self._lock = asyncio.Lock()
+        self._subscribers = {}
+
+    async def subscribe(self, event_id: int) -> asyncio.Queue:
+        async with self._lock:
+            if self._connection is None:
+                self._connection = await sync_to_async(_open_listen_connection)()
+                asyncio.get_running_loop().add_reader(self._connection.fileno(), self._on_notify)
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(event_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, event_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(event_id, set())
+        queues.discard(queue)
+        if not queues:
+            self._subscribers.pop(event_id, None)
+        if not self._subscribers:
+            self._disconnect()
+
+    def _disconnect(self) -> None:
+        if self._connection is None:
+            return
+        asyncio.get_running_loop().remove_reader(self._connection.fileno())
+        self._connection.close()
+        self._connection = None
+
+    def _on_notify(self) -> None:
+        try:
+            self._connection.poll()
+        except Exception:
+            # подключение потеряно: завершаем потоки, браузеры переподключатся сами
+            for queues in self._subscribers.values():
+                for queue in queues:
+                    queue.put_nowait(None)
+            self._disconnect()
+            return
+        while self._connection.notifies:
+            notify = self._connection.notifies.pop(0)
+            for queue in self._subscribers.get(int(notify.payload), ()):
+                queue.put_nowait(True)
+
+
+_listeners = weakref.WeakKeyDictionary()
+
+
+def _get_listener() -> ResultsListener:
+    loop = asyncio.get_running_loop()
+    if loop not in _listeners:
+        _listeners[loop] = ResultsListener()
+    return _listeners[loop]
+
+
+def _get_live_state(event_id: int) -> dict or None:
+    event = Event.objects.filter(id=event_id).first()
+    return services.get_results_live_state(event=event) if event else None
+
+
+def _get_delta(old: dict or None, new: dict or None) -> dict or None:
+    """ Изменения между двумя состояниями get_results_live_state(), None - изменений нет """
+    if new is None or (old is not None and old['layout'] != new['layout']):
+        return {'reload': True}
+    old_rows = old['rows'] if old else {}
+    old_scores = old['scores'] if old else {}
+    delta = {
+        'rows': [row for participant_id, row in new['rows'].items() if old_rows.get(participant_id) != row],
+        'removed': [participant_id for participant_id in old_rows if participant_id not in new['rows']],
+        'scores': {table: scores for table, scores in new['scores'].items() if old_scores.get(table) != scores},
+    }
+    return delta if any(delta.values()) else None
+
+
+def _sse_message(data: dict) -> str:
+    return f'event: results\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+async def results_stream(event_id: int):
+    """ SSE-поток изменений результатов соревнования. Первое сообщение - все строки,
+    дальше только изменившиеся после каждого commit с новыми результатами """
+    listener = _get_listener()
+    queue = await listener.subscribe(event_id=event_id)
+    try:
+        state = None
+        while True:
+            new_state = await sync_to_async(_get_live_state)(event_id)
+            delta = _get_delta(old=state, new=new_state)
+            if delta:
+                yield _sse_message(data=delta)
+                if delta.get('reload'):
+                    return
+            state = new_state
+
+            while True:
+                try:
+                    notified = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_INTERVAL)
+                    break
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+            if notified is None:
+                return
+            # несколько commit подряд - один пересчёт
+            while not queue.empty():
+                if queue.get_nowait() is None:
+                    return
+    finally:
+        listener.unsubscribe(event_id=event_id, queue=queue)
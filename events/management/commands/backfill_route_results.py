@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from events.models import Event
+from events import services
+
+
+class Command(BaseCommand):
+    help = 'Заполняет таблицу RouteResult из прохождений участников (все соревнования или --event)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--event', type=int, action='append', help='id соревнования, можно несколько')
+
+    def handle(self, *args, **options):
+        events = Event.objects.order_by('id')
+        if options['event']:
+            events = events.filter(id__in=options['event'])
+        for event_id in events.values_list('id', flat=True):
+            rows = services.rebuild_route_results(event_id=event_id)
+            self.stdout.write(f'event {event_id}: {rows} route results')
@@ -0,0 +1,62 @@
+import io
+import random
+import time
+import tracemalloc
+from typing import Iterable
+
+from django.core.management.base import BaseCommand
+
+from events.models import Event, Participant, Route
+from events import services, xl_tools
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время и пиковую память выгрузки протокола результатов в xlsx вместе с данными (без БД)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--participants', type=int, default=5000)
+        parser.add_argument('--routes', type=int, default=60)
+        parser.add_argument('--groups', type=int, default=4)
+
+    @staticmethod
+    def _get_rows(count: int, routes_num: int) -> Iterable:
+        for i in range(count):
+            participant = Participant(id=i, first_name=f'Имя {i}', last_name=f'Фамилия {i}', birth_year=2000,
+                                      city='Город', team='Команда', place=i + 1)
+            accents = [f'{random.randint(0, 5)}/{random.randint(0, 5)}' for _ in range(routes_num)]
+            yield dict(participant=participant, accents=accents, score=0, score_view='100.0')
+
+    def _get_result(self, event: Event, participants: int, stream: bool) -> dict:
+        """ Как services.get_results() (все строки в памяти) или services.get_results_stream() (генераторы) """
+        groups = services.get_group_list(event=event)
+        genders = (Participant.GENDER_MALE, Participant.GENDER_FEMALE)
+        per_group = participants // (len(genders) * len(groups))
+        result = {}
+        for gender in genders:
+            result[gender] = []
+            for name in groups:
+                rows = self._get_rows(count=per_group, routes_num=event.routes_num)
+                result[gender].append(dict(name=name, data=rows if stream else list(rows),
+                                           scores=['1.0\n0.8'] * event.routes_num))
+        return result
+
+    def handle(self, *args, **options):
+        routes_num = options['routes']
+        event = Event(title='Bench', gym='Bench', routes_num=routes_num, score_type=Event.SCORE_PROPORTIONAL,
+                      is_view_route_grade=True, group_num=options['groups'],
+                      group_list=','.join(f'Группа {i + 1}' for i in range(options['groups'])))
+        routes = [Route(number=no + 1) for no in range(routes_num)]
+
+        for write_only, stream in ((False, False), (True, True)):
+            random.seed(0)
+            # память считается вместе с данными протокола, а не только с книгой
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = self._get_result(event=event, participants=options['participants'], stream=stream)
+            book = xl_tools.write_result_book(event=event, result=result, routes=routes, write_only=write_only)
+            book.save(io.BytesIO())
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            mode = 'write-only, streamed rows' if write_only else 'template copy, rows in memory'
+            self.stdout.write(f'{mode}: {elapsed:.1f} s, peak {peak / 2 ** 20:.0f} MiB')
@@ -0,0 +1,45 @@
+import random
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from events.models import Event, Participant, Route
+from events import services
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время подсчёта результатов группы (без БД)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--participants', type=int, default=500)
+        parser.add_argument('--routes', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--engine', choices=[services.SCORING_ENGINE_PYTHON, services.SCORING_ENGINE_NUMPY],
+                            default=services.SCORING_ENGINE_PYTHON)
+
+    def handle(self, *args, **options):
+        if options['engine'] == services.SCORING_ENGINE_NUMPY:
+            from events import np_scoring
+            update_group_scores = np_scoring.update_group_scores
+        else:
+            update_group_scores = services._update_group_scores
+
+        random.seed(0)
+        routes_num = options['routes']
+        json_key = f'{Participant.GENDER_MALE}_0'
+        participants = []
+        for i in range(options['participants']):
+            tops, zones = [], []
+            for no in range(routes_num):
+                accent = services._debug_get_random_accent()
+                tops.append(accent.top)
+                zones.append(accent.zone)
+            participant = Participant(id=i, is_entered_result=True, tops=tops, zones=zones)
+            participants.append(participant)
+        routes = [Route(number=no + 1, score_json={}) for no in range(routes_num)]
+
+        for score_type, label in Event.SCORE_TYPE:
+            event = Event(score_type=score_type, routes_num=routes_num, count_routes_num=5)
+            t = min(timeit.repeat(lambda: update_group_scores(event, participants, routes, json_key),
+                                  number=1, repeat=options['repeat']))
+            self.stdout.write(f'{score_type} ({label}): {t * 1000:.1f} ms')
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from events import services
+
+
+class Command(BaseCommand):
+    help = 'Выполняет задания на формирование протоколов из очереди ProtocolJob'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=2, help='Пауза при пустой очереди, сек')
+        parser.add_argument('--once', action='store_true', help='Выполнить готовые задания и выйти')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            services.requeue_stale_protocol_jobs()
+            job = services.claim_protocol_job()
+            if job:
+                services.run_protocol_job(job=job)
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
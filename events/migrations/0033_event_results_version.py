@@ -0,0 +1,19 @@
+# Generated by Django 6.0.7 on 2026-10-18 14:56
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0032_event_registration_close_datetime_alter_route_color'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='results_version',
+            field=models.UUIDField(default=uuid.uuid4, editable=False),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.7 on 2026-10-18 15:01
+
+import random
+
+from django.db import migrations, models
+
+
+def participants_fix_duplicate_pins(apps, schema_editor):
+    Participant = apps.get_model("events", "Participant")
+    duplicates = Participant.objects.values('event_id', 'pin').annotate(num=models.Count('id')).filter(
+        num__gt=1, pin__isnull=False)
+    for duplicate in duplicates:
+        taken = set(Participant.objects.filter(event_id=duplicate['event_id']).values_list('pin', flat=True))
+        free = [pin for pin in range(1000, 10000) if pin not in taken]
+        random.shuffle(free)
+        participants = Participant.objects.filter(event_id=duplicate['event_id'], pin=duplicate['pin']).order_by('id')
+        for p in participants[1:]:
+            p.pin = free.pop() if free else None
+            p.save(update_fields=['pin'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0033_event_results_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(participants_fix_duplicate_pins, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='participant',
+            constraint=models.UniqueConstraint(fields=('event', 'pin'), name='unique_participant_pin_per_event'),
+        ),
+    ]
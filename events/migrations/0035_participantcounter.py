@@ -0,0 +1,45 @@
+# Generated by Django 6.0.7 on 2026-10-18 15:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def participant_counters_init(apps, schema_editor):
+    Participant = apps.get_model("events", "Participant")
+    ParticipantCounter = apps.get_model("events", "ParticipantCounter")
+    counters = []
+    for kind, field, filters in (('total', None, {}),
+                                 ('entered', None, {'is_entered_result': True}),
+                                 ('paid', None, {'paid': True}),
+                                 ('set', 'set_index', {}),
+                                 ('group', 'group_index', {})):
+        fields = ['event_id', field] if field else ['event_id']
+        rows = Participant.objects.filter(**filters).values(*fields).annotate(num=models.Count('id')).order_by()
+        for row in rows:
+            counters.append(ParticipantCounter(event_id=row['event_id'], kind=kind, index=row[field] if field else 0,
+                                               value=row['num']))
+    ParticipantCounter.objects.bulk_create(counters, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0034_participant_unique_pin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParticipantCounter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('total', 'Всего'), ('entered', 'С результатами'), ('paid', 'Оплатили'), ('set', 'В сете'), ('group', 'В группе')], max_length=8)),
+                ('index', models.IntegerField(default=0)),
+                ('value', models.IntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participant_counter', to='events.event')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('event', 'kind', 'index'), name='unique_participant_counter')],
+            },
+        ),
+        migrations.RunPython(participant_counters_init, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.7 on 2026-10-18 15:06
+
+from django.db import migrations, models
+
+
+def routes_remove_duplicate_numbers(apps, schema_editor):
+    Route = apps.get_model("events", "Route")
+    duplicates = Route.objects.values('event_id', 'number').annotate(num=models.Count('id')).filter(num__gt=1)
+    for duplicate in duplicates:
+        routes = Route.objects.filter(event_id=duplicate['event_id'], number=duplicate['number']).order_by('id')
+        Route.objects.filter(id__in=[route.id for route in routes[1:]]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0035_participantcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['event', 'gender', 'group_index'], name='participant_event_group_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['event', 'set_index'], name='participant_event_set_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='promocode',
+            index=models.Index(fields=['event', 'title'], name='promocode_event_title_idx'),
+        ),
+        migrations.RunPython(routes_remove_duplicate_numbers, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='route',
+            constraint=models.UniqueConstraint(fields=('event', 'number'), name='unique_route_number_per_event'),
+        ),
+    ]
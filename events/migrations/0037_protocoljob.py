@@ -0,0 +1,35 @@
+# Generated by Django 6.0.7 on 2026-10-18 15:12
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0036_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProtocolJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('PENDING', 'В очереди'), ('RUNNING', 'Формируется'), ('DONE', 'Готов'), ('FAILED', 'Ошибка')], default='PENDING', max_length=8)),
+                ('progress', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('file', models.CharField(blank=True, default='', max_length=100)),
+                ('error', models.TextField(blank=True, default='')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='protocol_job', to='events.event')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'run_after'], name='protocol_job_queue_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('status', 'PENDING')), fields=('event',), name='unique_pending_protocol_job')],
+            },
+        ),
+    ]
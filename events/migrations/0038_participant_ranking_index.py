@@ -0,0 +1,21 @@
+# Generated by Django 6.0.7 on 2026-10-18 15:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0037_protocoljob'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='participant',
+            name='participant_event_group_idx',
+        ),
+        migrations.AddIndex(
+            model_name='participant',
+            index=models.Index(fields=['event', 'gender', 'group_index', '-score', 'last_name'], name='participant_ranking_idx'),
+        ),
+    ]
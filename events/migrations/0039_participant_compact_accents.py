@@ -0,0 +1,60 @@
+# Generated by Django 6.0.7 on 2026-10-18 15:17
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+def participants_fill_compact_accents(apps, schema_editor):
+    # прохождения из french_accents, а если в нём нет ни одной пройденной трассы - из устаревшего accents
+    # {"0": "1", "1": "2"} (1 - флеш, 2 - редпоинт; зона засчитывается вместе с топом, как в form_data_to_results).
+    # Длина списков - число трасс соревнования, трассы за его пределами не переносятся
+    Participant = apps.get_model("events", "Participant")
+    participants = []
+    for p in Participant.objects.select_related('event').only(
+            'id', 'accents', 'french_accents', 'event__routes_num').iterator(chunk_size=1000):
+        routes_num = p.event.routes_num or 0
+        items = [(int(no), int(accent.get('top', 0)), int(accent.get('zone', 0)))
+                 for no, accent in (p.french_accents or {}).items()]
+        if not any(top or zone for _, top, zone in items):
+            items = [(int(no), int(accent), int(accent)) for no, accent in (p.accents or {}).items()]
+        p.tops, p.zones = [0] * routes_num, [0] * routes_num
+        for no, top, zone in items:
+            if 0 <= no < routes_num:
+                p.tops[no], p.zones[no] = top, zone
+        participants.append(p)
+    Participant.objects.bulk_update(participants, fields=['tops', 'zones'], batch_size=1000)
+
+
+def participants_fill_french_accents(apps, schema_editor):
+    Participant = apps.get_model("events", "Participant")
+    participants = []
+    for p in Participant.objects.only('id', 'tops', 'zones').iterator(chunk_size=1000):
+        p.french_accents = {str(no): {'top': top, 'zone': zone}
+                            for no, (top, zone) in enumerate(zip(p.tops, p.zones)) if top or zone}
+        participants.append(p)
+    Participant.objects.bulk_update(participants, fields=['french_accents'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0038_participant_ranking_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='participant',
+            name='tops',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.AddField(
+            model_name='participant',
+            name='zones',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.PositiveSmallIntegerField(), blank=True, default=list, size=None),
+        ),
+        migrations.RunPython(participants_fill_compact_accents, participants_fill_french_accents),
+        migrations.RemoveField(
+            model_name='participant',
+            name='french_accents',
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.7 on 2026-10-18 15:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('events', '0039_participant_compact_accents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RouteResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('top', models.PositiveSmallIntegerField(default=0)),
+                ('zone', models.PositiveSmallIntegerField(default=0)),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_result', to='events.event')),
+                ('participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_result', to='events.participant')),
+                ('route', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='route_result', to='events.route')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('participant', 'route'), name='unique_route_result')],
+            },
+        ),
+    ]
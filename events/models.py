@@ -1,7 +1,10 @@
+import uuid
+
 from colorfield.fields import ColorField
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from django.contrib.postgres.fields import ArrayField
 from phonenumber_field.modelfields import PhoneNumberField
 
@@ -75,6 +78,23 @@ def _get_blank_french_accents_json():
     return {"0": {"top": 0, "zone": 0}}
 
 
+def encode_accents(french_accents: dict, routes_num: int) -> tuple:
+    """ {"0": {"top": 2, "zone": 1}, "2": {"top": 1, "zone": 1}}, routes_num=4 -> ([2, 0, 1, 0], [1, 0, 1, 0]).
+    Номер трассы - целое от 0 до routes_num - 1, попытки - целые не меньше 0, иначе ValueError """
+    routes_num = routes_num or 0
+    tops, zones = [0] * routes_num, [0] * routes_num
+    for no, accent in (french_accents or {}).items():
+        if not str(no).isdigit() or int(no) >= routes_num:
+            raise ValueError(f'Invalid route number: {no}')
+        if not isinstance(accent, dict):
+            raise ValueError(f'Invalid accent for route {no}: {accent}')
+        top, zone = int(accent.get('top', 0)), int(accent.get('zone', 0))
+        if top < 0 or zone < 0:
+            raise ValueError(f'Invalid accent for route {no}: {accent}')
+        tops[int(no)], zones[int(no)] = top, zone
+    return tops, zones
+
+
 def _get_default_route_score_json():
     return {'all': 1}
 
@@ -203,6 +223,8 @@ class Event(models.Model):
         (PAY_TYPE_SBP, 'СБП (QR-код)'),
     ]
     pay_type = models.CharField(max_length=20, choices=PAY_TYPE, default=PAY_TYPE_YOOMONEY)
+    # версия результатов, меняется при любом изменении соревнования, участников или трасс (см. events/signals.py)
+    results_version = models.UUIDField(default=uuid.uuid4, editable=False)
 
     @property
     def date_display(self) -> str:
@@ -275,19 +297,64 @@ class Participant(models.Model):
     reg_type_index = models.IntegerField(default=0)
 
     accents = models.JSONField(blank=True, null=True, default=_get_blank_accents_json)
-    french_accents = models.JSONField(blank=True, null=True, default=_get_blank_french_accents_json)
     french_score = models.CharField(max_length=20, blank=True, null=True)
     place = models.IntegerField(default=0)
     email = models.EmailField(max_length=100, blank=True, null=True)
     paid = models.BooleanField(default=False)
     scores = models.JSONField(default=_get_blank_json)
     counted_routes = ArrayField(models.IntegerField(), blank=True, null=True, default=_get_default_array)
+    # прохождения по номеру трассы: попытки на топ и на зону (0 - не пройдена).
+    # Записываются и читаются в формате JSON через свойство french_accents
+    tops = ArrayField(models.PositiveSmallIntegerField(), blank=True, default=list)
+    zones = ArrayField(models.PositiveSmallIntegerField(), blank=True, default=list)
 
     phone_number = PhoneNumberField(blank=True)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'pin'], name='unique_participant_pin_per_event'),
+        ]
+        indexes = [
+            # выборка группы и порядок строк протокола результатов (-score, last_name)
+            models.Index(fields=['event', 'gender', 'group_index', '-score', 'last_name'],
+                         name='participant_ranking_idx'),
+            models.Index(fields=['event', 'set_index'], name='participant_event_set_idx'),
+        ]
+
     def __str__(self):
         return f'<Part-t: Name={self.last_name}, PIN={self.pin}, Score={self.score}, set={self.set_index}>'
 
+    COUNTED_FIELDS = ('set_index', 'group_index', 'is_entered_result', 'paid')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # состояние из БД для пересчёта ParticipantCounter при сохранении (см. events/signals.py)
+        instance.counted_state = instance.get_counted_state()
+        # прохождения из БД: RouteResult пересобирается при сохранении, только если они изменились
+        instance.compact_state = instance.get_compact_state()
+        return instance
+
+    @property
+    def french_accents(self) -> dict:
+        """ Пройденные трассы из tops/zones: {"0": {"top": 2, "zone": 1}, "2": {"top": 1, "zone": 1}} """
+        return {str(no): {'top': top, 'zone': zone}
+                for no, (top, zone) in enumerate(zip(self.tops, self.zones)) if top or zone}
+
+    @french_accents.setter
+    def french_accents(self, value: dict):
+        self.tops, self.zones = encode_accents(french_accents=value, routes_num=self.event.routes_num)
+
+    def get_compact_state(self) -> tuple or None:
+        if self.get_deferred_fields().intersection(('tops', 'zones')):
+            return None
+        return tuple(self.tops), tuple(self.zones)
+
+    def get_counted_state(self) -> tuple or None:
+        if self.get_deferred_fields().intersection(self.COUNTED_FIELDS):
+            return None
+        return tuple(getattr(self, field) for field in self.COUNTED_FIELDS)
+
 
 class Route(models.Model):
     points_male = models.FloatField(default=1)
@@ -300,10 +367,56 @@ class Route(models.Model):
 
     score_json = models.JSONField(default=_get_default_route_score_json)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'number'], name='unique_route_number_per_event'),
+        ]
+
     def __str__(self):
         return f'N={self.number}, score={self.score_json}'
 
 
+class RouteResult(models.Model):
+    """ Прохождение трассы участником: копия Participant.tops/zones построчно для агрегации в SQL
+    (статистика трасс, рейтинг по трассе). Хранятся только трассы с топом или зоной, поддерживается сигналами """
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='route_result')
+    participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='route_result')
+    route = models.ForeignKey(Route, on_delete=models.CASCADE, related_name='route_result')
+    top = models.PositiveSmallIntegerField(default=0)
+    zone = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['participant', 'route'], name='unique_route_result'),
+        ]
+
+
+class ParticipantCounter(models.Model):
+    """ Денормализованные счётчики участников соревнования: всего, с результатами, оплативших,
+    по сетам и по группам (index - номер сета/группы). Поддерживаются сигналами Participant """
+    KIND_TOTAL = 'total'
+    KIND_ENTERED = 'entered'
+    KIND_PAID = 'paid'
+    KIND_SET = 'set'
+    KIND_GROUP = 'group'
+    KINDS = [
+        (KIND_TOTAL, 'Всего'),
+        (KIND_ENTERED, 'С результатами'),
+        (KIND_PAID, 'Оплатили'),
+        (KIND_SET, 'В сете'),
+        (KIND_GROUP, 'В группе'),
+    ]
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='participant_counter')
+    kind = models.CharField(max_length=8, choices=KINDS)
+    index = models.IntegerField(default=0)
+    value = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event', 'kind', 'index'], name='unique_participant_counter'),
+        ]
+
+
 class PromoCode(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='PromoCode')
     title = models.CharField(max_length=32)
@@ -311,6 +424,11 @@ class PromoCode(models.Model):
     applied_num = models.IntegerField(default=0, blank=True, null=True)
     max_applied_num = models.IntegerField(default=0, blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['event', 'title'], name='promocode_event_title_idx'),
+        ]
+
 
 class PayDetail(models.Model):
     event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='PayDetail')
@@ -320,3 +438,37 @@ class PayDetail(models.Model):
     datetime = models.DateTimeField(auto_now_add=True)
     amount = models.FloatField(default=0)
     operation_id = models.CharField(max_length=100)
+
+
+class ProtocolJob(models.Model):
+    """ Задание на формирование итогового протокола. Выполняется командой protocol_worker,
+    на соревнование не больше одного ожидающего задания: повторные запросы присоединяются к нему """
+    STATUS_PENDING = 'PENDING'
+    STATUS_RUNNING = 'RUNNING'
+    STATUS_DONE = 'DONE'
+    STATUS_FAILED = 'FAILED'
+    STATUSES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Формируется'),
+        (STATUS_DONE, 'Готов'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+    event = models.ForeignKey(Event, on_delete=models.CASCADE, related_name='protocol_job')
+    status = models.CharField(max_length=8, choices=STATUSES, default=STATUS_PENDING)
+    progress = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    file = models.CharField(max_length=100, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['event'], condition=models.Q(status='PENDING'),
+                                    name='unique_pending_protocol_job'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='protocol_job_queue_idx'),
+        ]
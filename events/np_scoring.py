@@ -0,0 +1,93 @@
+""" Векторизованный подсчёт результатов группы (SCORING_ENGINE=numpy).
+Результаты совпадают с services._update_group_scores бит-в-бит. """
+import numpy as np
+
+from events import services
+from events.models import Event
+
+
+def _get_accents_matrix(participants: list, routes_num: int) -> tuple:
+    """ Матрицы участники x трассы: попытки на топ и на зону """
+    tops = np.zeros((len(participants), routes_num), dtype=np.int64)
+    zones = np.zeros((len(participants), routes_num), dtype=np.int64)
+    for i, p in enumerate(participants):
+        p_tops, p_zones = p.tops[:routes_num], p.zones[:routes_num]
+        tops[i, :len(p_tops)] = p_tops
+        zones[i, :len(p_zones)] = p_zones
+    return tops, zones
+
+
+def _get_routes_accents_num(event: Event, participants: list, routes: list, tops: np.ndarray) -> list:
+    if event.score_type != Event.SCORE_PROPORTIONAL:
+        return [0] * len(routes)
+    if not event.is_count_only_entered_results:
+        return [len(participants)] * len(routes)
+    entered = np.array([p.is_entered_result for p in participants], dtype=bool)
+    return ((tops[:, :len(routes)] > 0) & entered[:, None]).sum(axis=0).tolist()
+
+
+def _get_route_values(event: Event, routes: list, json_key: str, width: int) -> tuple:
+    """ Баллы за flash и за redpoint для каждой трассы.
+    Считаются по одной на трассу тем же выражением, что и в services, поэтому округление совпадает """
+    if event.score_type == Event.SCORE_NUM_ACCENTS:
+        return np.full(width, 101, dtype=np.int64), np.full(width, 100, dtype=np.int64)
+    flash_k = 1 + event.flash_points_pc / 100
+    base_points = [route.score_json.get(json_key, 0) for route in routes] + [0] * (width - len(routes))
+    if event.score_type == Event.SCORE_GRADE:
+        flash_values = [round(base * flash_k, 2) for base in base_points]
+        redpoint_values = [round(base, 2) for base in base_points]
+    else:
+        flash_values = [round(base * flash_k * event.redpoint_points, 2) for base in base_points]
+        redpoint_values = [round(base * event.redpoint_points, 2) for base in base_points]
+    return np.array(flash_values, dtype=np.float64), np.array(redpoint_values, dtype=np.float64)
+
+
+def _update_french_scores(event: Event, participants: list, tops: np.ndarray, zones: np.ndarray) -> None:
+    tops_num = (tops > 0).sum(axis=1).tolist()
+    tops_a = tops.sum(axis=1).tolist()
+    zones_num = (zones > 0).sum(axis=1).tolist()
+    zones_a = zones.sum(axis=1).tolist()
+    for i, p in enumerate(participants):
+        p.score = 10000*tops_num[i] + 1000*zones_num[i] + 100*(100-tops_a[i]) + 10*(100-zones_a[i])
+        p.french_score = f'{tops_num[i]}T{tops_a[i]} {zones_num[i]}z{zones_a[i]}'
+        p.counted_routes = list(range(event.routes_num))
+
+
+def _update_points_scores(event: Event, participants: list, routes: list, json_key: str, tops: np.ndarray) -> None:
+    flash_values, redpoint_values = _get_route_values(event=event, routes=routes, json_key=json_key,
+                                                      width=tops.shape[1])
+    is_topped = tops > 0
+    values = np.where(tops == 1, flash_values, redpoint_values) * is_topped
+
+    # стабильная сортировка по убыванию: при равных баллах порядок трасс как в services
+    order = np.argsort(np.where(is_topped, -values, np.inf), axis=1, kind='stable')
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    counted_num = is_topped.sum(axis=1)
+    num_of_best_scores = services._get_num_of_best_scores(event=event)
+    if num_of_best_scores:
+        counted_num = np.minimum(counted_num, num_of_best_scores)
+
+    # суммируем по столбцам последовательно, как sum() в services
+    totals = np.zeros(len(participants), dtype=values.dtype)
+    for j in range(int(counted_num.max(initial=0))):
+        totals = totals + np.where(j < counted_num, sorted_values[:, j], 0)
+
+    values_list = values.tolist()
+    for i, p in enumerate(participants):
+        p.scores = {str(no): values_list[i][no] for no in np.flatnonzero(is_topped[i]).tolist()}
+        p.score = round(totals[i].item(), 2)
+        p.counted_routes = order[i, :counted_num[i]].tolist()
+
+
+def update_group_scores(event: Event, participants: list, routes: list, json_key: str) -> list:
+    """ Аналог services._update_group_scores: обновляет трассы и участников в памяти,
+    возвращает изменившиеся трассы """
+    tops, zones = _get_accents_matrix(participants=participants, routes_num=len(routes))
+    changed_routes = services._update_routes_score(
+        event=event, routes=routes, json_key=json_key,
+        routes_accents_num=_get_routes_accents_num(event=event, participants=participants, routes=routes, tops=tops))
+    if event.score_type == Event.SCORE_FRENCH:
+        _update_french_scores(event=event, participants=participants, tops=tops, zones=zones)
+    else:
+        _update_points_scores(event=event, participants=participants, routes=routes, json_key=json_key, tops=tops)
+    return changed_routes
@@ -36,13 +36,14 @@ class EventSerializer(serializers.ModelSerializer):
 class ParticipantSerializer(serializers.ModelSerializer):
     city = serializers.CharField(required=False, allow_blank=True, allow_null=True)
     team = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+    french_accents = serializers.JSONField(read_only=True)
 
     class Meta:
         model = Participant
         fields = '__all__'
         read_only_fields = [
             'pin', 'score', 'place', 'is_entered_result', 
-            'accents', 'french_accents', 'french_score', 'scores', 'counted_routes'
+            'accents', 'tops', 'zones', 'french_score', 'scores', 'counted_routes'
         ]
 
 
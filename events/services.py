@@ -1,27 +1,39 @@
+from collections import Counter
 from dataclasses import asdict, dataclass
+import hashlib
 import io
+import json
+import logging
 import operator
 import os
 import random
 import string
-from datetime import datetime
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache, partial
 from typing import Iterable
-import dacite
 from openpyxl import load_workbook
 from events.xl_tools import save_virtual_workbook
 
 import segno
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
-from django.db.models import QuerySet, Count
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F, Q, QuerySet, Count
 from django.http import HttpResponse
+from django.utils import timezone
 
 from config import settings
 from events import xl_tools, mock
-from events.exceptions import DuplicateParticipantError, ParticipantTooYoungError
+from events.exceptions import DuplicateParticipantError, ParticipantTooYoungError, RegistrationFullError
 from events.models import ACCENT_REDPOINT, CustomUser, Event, PayDetail, PromoCode, Route, Participant, Wallet
+from events.models import ParticipantCounter, ProtocolJob, RouteResult, encode_accents
 from events.models import ACCENT_NO, ACCENT_FLASH
 
+logger = logging.getLogger(settings.LOGGER)
+
 
 def create_event(owner: get_user_model(), title: str, date: datetime, date_end: datetime = None) -> Event:
     superuser = CustomUser.objects.filter(is_superuser=True).first() or CustomUser.objects.filter(id=1).first()
@@ -63,11 +75,17 @@ def _get_all_json_keys(event: Event) -> Iterable:
 
 
 def remove_routes(event: Event) -> None:
+    # связанные RouteResult удаляются каскадом, версия результатов - одна на транзакцию
     event.route.all().delete()
 
 
 def remove_participants(event: Event) -> None:
-    event.participant.all().delete()
+    with transaction.atomic():
+        # каскадом удаляются PayDetail и RouteResult; счётчики не обновляются на каждого участника,
+        # а удаляются целиком
+        with participant_counters_disabled():
+            event.participant.all().delete()
+        event.participant_counter.all().delete()
 
 
 def remove_event(event: Event) -> None:
@@ -75,19 +93,20 @@ def remove_event(event: Event) -> None:
 
 
 def clear_event(event: Event) -> None:
-    remove_participants(event=event)
-    remove_routes(event=event)
-    create_event_routes(event=event)
+    with transaction.atomic():
+        remove_participants(event=event)
+        remove_routes(event=event)
+        create_event_routes(event=event)
 
 
 def clear_results(event: Event) -> None:
-    participants = event.participant.all()
-    for participant in participants:
-        _clear_participant_score(participant=participant)
-    routes = event.route.all()
-    for route in routes:
-        route.score_json.clear()
-        route.save()
+    with transaction.atomic():
+        event.participant.update(score=0, accents={}, tops=[], zones=[], is_entered_result=False)
+        event.route.update(score_json={})
+        event.route_result.all().delete()
+        # update() не вызывает сигналы: счётчик и версию результатов обновляем сами
+        event.participant_counter.filter(kind=ParticipantCounter.KIND_ENTERED).update(value=0)
+        bump_results_version(event_id=event.id)
 
 
 # ================================================
@@ -99,7 +118,9 @@ def update_event_settings(event: Event, cd: dict) -> None:
     need_update_results = event.score_type != cd['score_type'] or \
         event.redpoint_points != cd['redpoint_points'] or \
         event.flash_points_pc != cd['flash_points_pc'] or \
-        event.count_routes_num != cd['count_routes_num']
+        event.count_routes_num != cd['count_routes_num'] or \
+        event.is_separate_score_by_groups != cd['is_separate_score_by_groups'] or \
+        event.is_count_only_entered_results != cd['is_count_only_entered_results']
 
     event.routes_num = cd['routes_num']
     event.is_published = cd['is_published']
@@ -135,9 +156,8 @@ def update_event_settings(event: Event, cd: dict) -> None:
     event.save()
 
     if old_routes_num != event.routes_num:
-        clear_results(event=event)
-        remove_routes(event=event)
-        create_event_routes(event=event)
+        resize_event_routes(event=event)
+        need_update_results = True
     if need_update_results:
         update_results(event=event)
 
@@ -178,17 +198,218 @@ def mark_events_as_expired(events: QuerySet) -> None:
 
 
 def create_event_routes(event: Event) -> None:
-    for i in range(event.routes_num):
-        Route.objects.create(
-            number=i + 1,
-            event=event,
-        )
+    Route.objects.bulk_create(Route(number=i + 1, event=event) for i in range(event.routes_num))
+    # bulk_create не вызывает сигналы post_save
+    bump_results_version(event_id=event.id)
+
+
+def _trim_accents(accents: dict, routes_num: int) -> dict:
+    return {no: accent for no, accent in (accents or {}).items() if int(no) < routes_num}
+
+
+def resize_event_routes(event: Event) -> None:
+    """ Приводит число трасс к event.routes_num: удаляет или добавляет трассы в конце списка.
+    Категории и цвета оставшихся трасс и результаты участников на них сохраняются """
+    with transaction.atomic():
+        event.route.filter(number__gt=event.routes_num).delete()
+        numbers = set(event.route.values_list('number', flat=True))
+        Route.objects.bulk_create(
+            Route(number=no, event=event) for no in range(1, event.routes_num + 1) if no not in numbers)
+        participants = []
+        for participant in event.participant.only('id', 'accents', 'tops', 'zones'):
+            accents = _trim_accents(accents=participant.accents, routes_num=event.routes_num)
+            compact_state = participant.get_compact_state()
+            participant.tops, participant.zones = encode_accents(
+                french_accents=_trim_accents(accents=participant.french_accents, routes_num=event.routes_num),
+                routes_num=event.routes_num)
+            if accents != participant.accents or participant.get_compact_state() != compact_state:
+                participant.accents = accents
+                participants.append(participant)
+        Participant.objects.bulk_update(participants, fields=['accents', 'tops', 'zones'], batch_size=500)
+        bump_results_version(event_id=event.id)
 
 
 def get_route_score(route: Route, json_key: str) -> float:
     return route.score_json.get(json_key, 0)
 
 
+# ================================================
+# ============= Participant counters =============
+# ================================================
+
+
+def _get_counter_keys(state: tuple) -> list:
+    """ Счётчики (kind, index), в которые входит участник с состоянием Participant.get_counted_state() """
+    set_index, group_index, is_entered_result, paid = state
+    keys = [
+        (ParticipantCounter.KIND_TOTAL, 0),
+        (ParticipantCounter.KIND_SET, set_index),
+        (ParticipantCounter.KIND_GROUP, group_index),
+    ]
+    if is_entered_result:
+        keys.append((ParticipantCounter.KIND_ENTERED, 0))
+    if paid:
+        keys.append((ParticipantCounter.KIND_PAID, 0))
+    return keys
+
+
+def _add_participant_counter(event_id: int, kind: str, index: int, delta: int) -> None:
+    counter = ParticipantCounter.objects.filter(event_id=event_id, kind=kind, index=index)
+    if counter.update(value=F('value') + delta) or delta < 0:
+        # отрицательной разницы без строки не бывает, кроме удаления соревнования целиком
+        return
+    try:
+        with transaction.atomic():
+            ParticipantCounter.objects.create(event_id=event_id, kind=kind, index=index, value=delta)
+    except IntegrityError:
+        # строку только что создал параллельный запрос
+        counter.update(value=F('value') + delta)
+
+
+_participant_counters_state = threading.local()
+
+
+@contextmanager
+def participant_counters_disabled():
+    """ Массовые изменения участников: сигналы не обновляют ParticipantCounter построчно,
+    счётчики обновляет вызывающий """
+    _participant_counters_state.disabled = True
+    try:
+        yield
+    finally:
+        _participant_counters_state.disabled = False
+
+
+def is_participant_counters_enabled() -> bool:
+    return not getattr(_participant_counters_state, 'disabled', False)
+
+
+def update_participant_counters(event_id: int, old_state: tuple or None, new_state: tuple or None) -> None:
+    """ Переносит участника в счётчиках из old_state в new_state (None - участника нет) """
+    delta = Counter(_get_counter_keys(state=new_state) if new_state else [])
+    delta.subtract(_get_counter_keys(state=old_state) if old_state else [])
+    for (kind, index), value in delta.items():
+        if value:
+            _add_participant_counter(event_id=event_id, kind=kind, index=index, delta=value)
+
+
+def rebuild_participant_counters(event_id: int) -> None:
+    """ Пересчитывает счётчики соревнования по таблице участников """
+    participants = Participant.objects.filter(event_id=event_id)
+    counter = Counter()
+    for state in participants.values_list(*Participant.COUNTED_FIELDS):
+        counter.update(_get_counter_keys(state=state))
+    with transaction.atomic():
+        ParticipantCounter.objects.filter(event_id=event_id).delete()
+        ParticipantCounter.objects.bulk_create(
+            ParticipantCounter(event_id=event_id, kind=kind, index=index, value=value)
+            for (kind, index), value in counter.items())
+
+
+def get_participant_counters(event: Event) -> dict:
+    """ Все счётчики соревнования одним запросом """
+    values = {kind: {} for kind, _ in ParticipantCounter.KINDS}
+    for kind, index, value in event.participant_counter.values_list('kind', 'index', 'value'):
+        values[kind][index] = value
+    return {
+        'total': values[ParticipantCounter.KIND_TOTAL].get(0, 0),
+        'entered': values[ParticipantCounter.KIND_ENTERED].get(0, 0),
+        'paid': values[ParticipantCounter.KIND_PAID].get(0, 0),
+        'sets': values[ParticipantCounter.KIND_SET],
+        'groups': values[ParticipantCounter.KIND_GROUP],
+    }
+
+
+def get_participants_charts(event: Event) -> dict:
+    """ Гистограммы участников по сетам, группам и городам одним запросом:
+    группировка по городу, в каждой строке условные Count по каждому сету и группе """
+    set_list = get_set_list(event=event)
+    group_list = get_group_list(event=event)
+    counts = {f'set_{i}': Count('id', filter=Q(set_index=i)) for i in range(len(set_list))}
+    counts.update({f'group_{i}': Count('id', filter=Q(group_index=i)) for i in range(len(group_list))})
+    # num как раньше - Count('city'): участники без города не попадают в число строки
+    rows = event.participant.values('city').annotate(num=Count('city'), **counts).order_by('-num', '-city')
+    return {
+        'set': {
+            'labels': set_list,
+            'data': [sum(row[f'set_{i}'] for row in rows) for i in range(len(set_list))],
+        },
+        'group': {
+            'labels': group_list,
+            'data': [sum(row[f'group_{i}'] for row in rows) for i in range(len(group_list))],
+        },
+        'city': {
+            'labels': [str(row['city']) for row in rows],
+            'data': [row['num'] for row in rows],
+        },
+    }
+
+
+# ================================================
+# ================ Route results =================
+# ================================================
+
+
+def _get_route_results(event_id: int, participant: Participant, route_ids: dict) -> list:
+    """ Строки RouteResult участника по его tops/zones, только трассы с топом или зоной """
+    return [RouteResult(event_id=event_id, participant_id=participant.id, route_id=route_ids[no + 1],
+                        top=top, zone=zone)
+            for no, (top, zone) in enumerate(zip(participant.tops, participant.zones))
+            if (top or zone) and no + 1 in route_ids]
+
+
+def sync_route_results(participant: Participant) -> None:
+    """ Пересобирает RouteResult участника после изменения прохождений """
+    with transaction.atomic():
+        RouteResult.objects.filter(participant_id=participant.id).delete()
+        if any(participant.tops) or any(participant.zones):
+            route_ids = dict(Route.objects.filter(event_id=participant.event_id).values_list('number', 'id'))
+            RouteResult.objects.bulk_create(
+                _get_route_results(event_id=participant.event_id, participant=participant, route_ids=route_ids))
+
+
+def rebuild_route_results(event_id: int) -> int:
+    """ Пересобирает RouteResult соревнования из прохождений участников, возвращает число строк """
+    route_ids = dict(Route.objects.filter(event_id=event_id).values_list('number', 'id'))
+    results = []
+    for participant in Participant.objects.filter(event_id=event_id).only('id', 'tops', 'zones'):
+        results.extend(_get_route_results(event_id=event_id, participant=participant, route_ids=route_ids))
+    with transaction.atomic():
+        RouteResult.objects.filter(event_id=event_id).delete()
+        RouteResult.objects.bulk_create(results, batch_size=1000)
+    return len(results)
+
+
+def get_route_stats(event: Event, gender: str = None, group_index: int = None) -> list:
+    """ Статистика трасс одним запросом GROUP BY по RouteResult: топы, флеши и зоны на каждой трассе.
+    Как и при подсчёте, при is_count_only_entered_results учитываются только внёсшие результаты """
+    results = event.route_result.all()
+    if event.is_count_only_entered_results:
+        results = results.filter(participant__is_entered_result=True)
+    if gender is not None:
+        results = results.filter(participant__gender=gender)
+    if group_index is not None:
+        results = results.filter(participant__group_index=group_index)
+    rows = results.values('route__number').annotate(
+        tops=Count('id', filter=Q(top__gt=0)),
+        flashes=Count('id', filter=Q(top=1)),
+        zones=Count('id', filter=Q(zone__gt=0)),
+    )
+    stats = {row['route__number']: row for row in rows}
+    return [{'number': number,
+             'tops': stats.get(number, {}).get('tops', 0),
+             'flashes': stats.get(number, {}).get('flashes', 0),
+             'zones': stats.get(number, {}).get('zones', 0)}
+            for number in range(1, event.routes_num + 1)]
+
+
+def get_route_leaderboard(route: Route, limit: int = 10) -> list:
+    """ Лучшие на трассе: топ за меньшее число попыток, при равенстве - зона за меньшее """
+    return list(route.route_result.filter(top__gt=0).order_by('top', 'zone', 'participant__last_name').values(
+        'participant_id', 'participant__first_name', 'participant__last_name', 'participant__gender',
+        'participant__group_index', 'top', 'zone')[:limit])
+
+
 # ================================================
 # ======== Register and edit participant =========
 # ================================================
@@ -198,8 +419,9 @@ def get_set_list_available(event: Event, participant: Participant = None) -> lis
     set_list_all = get_set_list(event=event)
     set_list = []
     if event.set_max_participants > 0:
+        sets_num = get_participant_counters(event=event)['sets']
         for i, item in enumerate(set_list_all):
-            set_participants_num = event.participant.filter(set_index=i).count()
+            set_participants_num = sets_num.get(i, 0)
             if set_participants_num < event.set_max_participants or (participant.set_index == i if participant else False):
                 set_list.append(item)
     else:
@@ -227,8 +449,10 @@ def get_registration_required_fields(event: Event) -> list:
 
 def update_participant(event: Event, participant: Participant, cd: dict) -> Participant:
     current_group_index = participant.group_index
+    current_gender = participant.gender
     new_group_index = get_group_list(event=event).index(cd['group_index']) if 'group_index' in cd else participant.group_index
-    need_update_results = 'group_index' in cd and current_group_index != new_group_index
+    need_update_results = ('group_index' in cd and current_group_index != new_group_index) or \
+        (Event.FIELD_GENDER in cd and current_gender != cd[Event.FIELD_GENDER])
 
     participant.event = event
     if 'first_name' in cd:
@@ -260,18 +484,55 @@ def update_participant(event: Event, participant: Participant, cd: dict) -> Part
     participant.save()
 
     if need_update_results:
-        _update_results(event=event, gender=participant.gender, group_index=current_group_index)
-        _update_results(event=event, gender=participant.gender, group_index=new_group_index)
+        routes = _get_event_routes(event=event)
+        _update_results(event=event, gender=current_gender, group_index=current_group_index, routes=routes)
+        _update_results(event=event, gender=participant.gender, group_index=new_group_index, routes=routes)
     return participant
 
 
+def _has_free_place(event: Event, set_index: int) -> bool:
+    """ Есть ли место в сете set_index и в соревновании (max_participants для не premium) """
+    counters = get_participant_counters(event=event)
+    if 0 < event.set_max_participants <= counters['sets'].get(set_index, 0):
+        return False
+    if not event.is_premium and event.max_participants is not None \
+            and counters['total'] >= event.max_participants:
+        return False
+    return True
+
+
 def _check_participants_number_to_close_registration(event: Event) -> None:
     if event.set_max_participants > 0 \
-            and event.participant.count() >= event.set_max_participants * event.set_num:
+            and get_participant_counters(event=event)['total'] >= event.set_max_participants * event.set_num:
         event.is_registration_open = False
         event.save()
 
 
+PIN_MIN = 1000
+PIN_MAX = 9999
+PIN_WINDOW = 32
+
+
+@lru_cache(maxsize=64)
+def _get_event_pin_pool(event_id: int) -> tuple:
+    """ Все 4-значные PIN в случайном, но постоянном для соревнования порядке.
+    Порядок зависит от SECRET_KEY, поэтому PIN следующего участника не угадать """
+    pool = list(range(PIN_MIN, PIN_MAX + 1))
+    random.Random(f'{settings.SECRET_KEY}:{event_id}').shuffle(pool)
+    return tuple(pool)
+
+
+def _get_free_pins(event: Event) -> Iterable:
+    """ Свободные PIN из пула по порядку. Начинаем с позиции, равной числу участников,
+    поэтому обычно подходит первый же кандидат: один запрос на окно из PIN_WINDOW кандидатов """
+    pool = _get_event_pin_pool(event_id=event.id)
+    start = get_participant_counters(event=event)['total']
+    for offset in range(start, start + len(pool), PIN_WINDOW):
+        window = [pool[i % len(pool)] for i in range(offset, min(offset + PIN_WINDOW, start + len(pool)))]
+        taken = set(event.participant.filter(pin__in=window).values_list('pin', flat=True))
+        yield from (pin for pin in window if pin not in taken)
+
+
 def _create_participant(event: Event, first_name: str, last_name: str,
                         gender: Participant.gender = Participant.GENDER_MALE,
                         birth_year: int = 2000, city: str = '', team: str = '',
@@ -282,28 +543,31 @@ def _create_participant(event: Event, first_name: str, last_name: str,
                         reg_type_index: int = 0,
                         phone_number: str = '',
                         ) -> Participant or None:
-    if 0 < event.set_max_participants <= event.participant.filter(set_index=set_index).count():
+    if 0 < event.set_max_participants <= get_participant_counters(event=event)['sets'].get(set_index, 0):
         return None
-    pin = 1111
-    while event.participant.filter(pin=pin).count() != 0:
-        pin = random.randint(1000, 9999)
-    participant = Participant.objects.create(
-        first_name=first_name,
-        last_name=last_name,
-        gender=gender,
-        birth_year=birth_year,
-        city=city,
-        team=team,
-        grade=grade,
-        event=event,
-        pin=pin,
-        group_index=group_index,
-        set_index=set_index,
-        email=email,
-        reg_type_index=reg_type_index,
-        phone_number=phone_number,
-    )
-    return participant
+    for pin in _get_free_pins(event=event):
+        try:
+            with transaction.atomic():
+                return Participant.objects.create(
+                    first_name=first_name,
+                    last_name=last_name,
+                    gender=gender,
+                    birth_year=birth_year,
+                    city=city,
+                    team=team,
+                    grade=grade,
+                    event=event,
+                    pin=pin,
+                    group_index=group_index,
+                    set_index=set_index,
+                    email=email,
+                    reg_type_index=reg_type_index,
+                    phone_number=phone_number,
+                )
+        except IntegrityError:
+            # PIN только что занял параллельный запрос (unique_participant_pin_per_event)
+            continue
+    return None
 
 
 def register_participant(event: Event, cd: dict) -> Participant:
@@ -312,9 +576,6 @@ def register_participant(event: Event, cd: dict) -> Participant:
     if not first_name or not last_name:
         raise ValueError("First name and last name are required.")
 
-    if event.participant.filter(first_name=first_name, last_name=last_name).exists():
-        raise DuplicateParticipantError
-
     birth_year = cd.get(Event.FIELD_BIRTH_YEAR, 0)
     if event.participant_min_age and birth_year:
         if datetime.today().year - int(birth_year) < event.participant_min_age:
@@ -335,43 +596,47 @@ def register_participant(event: Event, cd: dict) -> Participant:
     else:
         set_idx = sets.index(set_val) if set_val in sets else 0
 
-    participant = _create_participant(
-        event=event,
-        first_name=first_name,
-        last_name=last_name,
-        gender=cd.get(Event.FIELD_GENDER, Participant.GENDER_MALE),
-        birth_year=birth_year or 0,
-        city=cd.get(Event.FIELD_CITY, ''),
-        team=cd.get(Event.FIELD_TEAM, ''),
-        grade=cd.get(Event.FIELD_GRADE, Participant.GRADE_BR),
-        group_index=group_idx,
-        set_index=set_idx,
-        email=cd.get(Event.FIELD_EMAIL, ''),
-        reg_type_index=cd.get('reg_type_index', 0),
-        phone_number=cd.get('phone_number', ''),
-    )
-    _check_participants_number_to_close_registration(event=event)
+    with transaction.atomic():
+        # блокируем строку соревнования: параллельные регистрации проверяют и занимают места по очереди
+        locked_event = Event.objects.select_for_update().get(id=event.id)
+        if locked_event.participant.filter(first_name=first_name, last_name=last_name).exists():
+            raise DuplicateParticipantError
+        if not _has_free_place(event=locked_event, set_index=set_idx):
+            raise RegistrationFullError
+
+        participant = _create_participant(
+            event=locked_event,
+            first_name=first_name,
+            last_name=last_name,
+            gender=cd.get(Event.FIELD_GENDER, Participant.GENDER_MALE),
+            birth_year=birth_year or 0,
+            city=cd.get(Event.FIELD_CITY, ''),
+            team=cd.get(Event.FIELD_TEAM, ''),
+            grade=cd.get(Event.FIELD_GRADE, Participant.GRADE_BR),
+            group_index=group_idx,
+            set_index=set_idx,
+            email=cd.get(Event.FIELD_EMAIL, ''),
+            reg_type_index=cd.get('reg_type_index', 0),
+            phone_number=cd.get('phone_number', ''),
+        )
+        if participant is None:
+            raise RegistrationFullError
+        _check_participants_number_to_close_registration(event=locked_event)
+    event.is_registration_open = locked_event.is_registration_open
     return participant
 
 
-def _clear_participant_score(participant: Participant) -> None:
-    participant.score = 0
-    participant.accents = {}
-    participant.french_accents = {}
-    participant.is_entered_result = False
-    participant.save()
-
-
 def is_registration_open(event: Event) -> bool:
     if not event.is_published:
         return False
     if not event.is_registration_open:
         return False
-    if event.set_max_participants != 0 and event.participant.count() >= event.set_max_participants * event.set_num:
+    participants_num = get_participant_counters(event=event)['total']
+    if event.set_max_participants != 0 and participants_num >= event.set_max_participants * event.set_num:
         return False
     if not event.is_premium:
-        if event.participant.count() >= event.max_participants:
-            return False        
+        if participants_num >= event.max_participants:
+            return False
     return True
 
 
@@ -386,6 +651,23 @@ class Accent:
     zone: int = 0
 
 
+NO_ACCENT = (0, 0)
+
+
+def get_participant_accents(participant: Participant, routes_num: int) -> list:
+    """ Прохождения участника [(top, zone), ...] из Participant.tops/zones, длиной routes_num """
+    accents = list(zip(participant.tops, participant.zones))[:routes_num]
+    if len(accents) < routes_num:
+        accents.extend([NO_ACCENT] * (routes_num - len(accents)))
+    return accents
+
+
+def get_participant_accents_json(participant: Participant, routes_num: int) -> dict:
+    """ Прохождения участника в формате french_accents: {"0": {"top": 2, "zone": 1}, ...} """
+    return {str(no): {'top': top, 'zone': zone}
+            for no, (top, zone) in enumerate(get_participant_accents(participant=participant, routes_num=routes_num))}
+
+
 def form_data_to_results(form_cleaned_data: list) -> dict:
     '''
     [{'top': 2, 'zone': 0}, {'top': 0, 'zone': 3} ... ] ->
@@ -409,31 +691,45 @@ def _calc_participant_score_by_scores(scores: dict, num_of_best_scores: int) ->
             }
 
 
-def _update_participant_score(event: Event, participant: Participant, routes: QuerySet, json_key: str):
+SCORING_ENGINE_PYTHON = 'python'
+SCORING_ENGINE_NUMPY = 'numpy'
+
+PARTICIPANT_RESULT_FIELDS = ['score', 'scores', 'counted_routes', 'french_score', 'place']
+
+
+def _get_participant_result_state(participant: Participant) -> tuple:
+    return tuple(getattr(participant, field) for field in PARTICIPANT_RESULT_FIELDS)
+
+
+def _update_participant_score(event: Event, participant: Participant, routes: list, json_key: str,
+                              accents: list = None):
+    """ Считаем результат участника без сохранения в БД.
+    accents - уже прочитанные get_participant_accents() прохождения участника """
+    if accents is None:
+        accents = get_participant_accents(participant=participant, routes_num=len(routes))
     scores = {}
     tops, tops_a, zones, zones_a = 0, 0, 0, 0
-    for no, accent in participant.french_accents.items():
+    for no, (top, zone) in enumerate(accents):
         score = 0
-        result = dacite.from_dict(data_class=Accent, data=accent)
 
         if event.score_type == Event.SCORE_FRENCH:
-            tops += 1 if result.top > 0 else 0
-            tops_a += result.top
-            zones += 1 if result.zone > 0 else 0
-            zones_a += result.zone
+            tops += 1 if top > 0 else 0
+            tops_a += top
+            zones += 1 if zone > 0 else 0
+            zones_a += zone
 
         else:
-            if result.top > 0:
+            if top > 0:
                 if event.score_type == Event.SCORE_NUM_ACCENTS:
-                    score = 100 + (1 if result.top == 1 else 0)
+                    score = 100 + (1 if top == 1 else 0)
                 else:
-                    base_route_points = routes[int(no)].score_json.get(json_key, 0)
+                    base_route_points = routes[no].score_json.get(json_key, 0)
                     flash_k = 1 + event.flash_points_pc / 100
-                    base_score_with_flash = base_route_points * flash_k if result.top == 1 else base_route_points
+                    base_score_with_flash = base_route_points * flash_k if top == 1 else base_route_points
                     if event.score_type != Event.SCORE_GRADE:
                         base_score_with_flash *= event.redpoint_points
                     score = base_score_with_flash
-                scores.update({no: round(score, 2)})
+                scores.update({str(no): round(score, 2)})
 
     if event.score_type == Event.SCORE_FRENCH:
         participant.score = 10000*tops + 1000*zones + 100*(100-tops_a) + 10*(100-zones_a)
@@ -442,48 +738,98 @@ def _update_participant_score(event: Event, participant: Participant, routes: Qu
     else:
         participant.scores = scores
         result = _calc_participant_score_by_scores(scores=scores,
-                                                   num_of_best_scores=int(event.count_routes_num) if (event.score_type == Event.SCORE_PROPORTIONAL or event.score_type == Event.SCORE_GRADE) else 0)
+                                                   num_of_best_scores=_get_num_of_best_scores(event=event))
         participant.score = result.get("score", 0)
-        participant.counted_routes = result.get("counted_routes", [])
-
-    participant.save()
+        participant.counted_routes = [int(no) for no in result.get("counted_routes", [])]
 
-def _update_results(event: Event, gender: Participant.GENDERS, group_index: int):
-    json_key = _get_participant_json_key(gender=gender, group_index=group_index)
 
-    participants = event.participant.filter(gender=gender, group_index=group_index) if event.is_separate_score_by_groups \
+def _get_group_participants(event: Event, gender: Participant.GENDERS, group_index: int) -> QuerySet:
+    return event.participant.filter(gender=gender, group_index=group_index) if event.is_separate_score_by_groups \
         else event.participant.filter(gender=gender)
 
-    # update routes:
-    routes = event.route.all().order_by('number')
-    for no, route in enumerate(routes):
-        # update_route_score:
-        route_score = 1
-        if event.score_type == Event.SCORE_SIMPLE_SUM:
-            route_score = 1.0
-        elif event.score_type == Event.SCORE_PROPORTIONAL:
-            accents_num = 0
-            # get num of accents of route:
-            if event.is_count_only_entered_results:
-                for p in participants:
-                    accent = dacite.from_dict(data_class=Accent, data=p.french_accents.get(
-                        str(no), {})) if p.is_entered_result else Accent()
-                    accents_num += 1 if accent.top > 0 else 0
-            else:
-                accents_num = len(participants)
-            route_score = 1 / accents_num if accents_num != 0 else 0
-        elif event.score_type == Event.SCORE_GRADE:
-            route_score = int(event.score_table.get(route.grade, 1))
-        elif event.score_type == Event.SCORE_NUM_ACCENTS:
-            route_score = 1
-        elif event.score_type == Event.SCORE_FRENCH:
-            route_score = 1
-        route.score_json.update({f'{json_key}': route_score})
-        route.save()
-
-    # update all participants in group:
-    for p in participants:
-        _update_participant_score(event=event, participant=p, routes=routes, json_key=json_key)
+
+def _get_num_of_best_scores(event: Event) -> int:
+    return int(event.count_routes_num) \
+        if (event.score_type == Event.SCORE_PROPORTIONAL or event.score_type == Event.SCORE_GRADE) else 0
+
+
+def _calc_route_score(event: Event, route: Route, accents_num: int) -> float:
+    if event.score_type == Event.SCORE_SIMPLE_SUM:
+        return 1.0
+    if event.score_type == Event.SCORE_PROPORTIONAL:
+        return 1 / accents_num if accents_num != 0 else 0
+    if event.score_type == Event.SCORE_GRADE:
+        return int(event.score_table.get(route.grade, 1))
+    return 1
+
+
+def _get_routes_accents_num(event: Event, participants: list, accents: list, routes: list) -> list:
+    """ Количество пролазов каждой трассы (нужно только для SCORE_PROPORTIONAL) """
+    if event.score_type != Event.SCORE_PROPORTIONAL:
+        return [0] * len(routes)
+    if not event.is_count_only_entered_results:
+        return [len(participants)] * len(routes)
+    # один проход по участникам, счётчики сразу для всех трасс
+    routes_accents_num = [0] * len(routes)
+    for p, p_accents in zip(participants, accents):
+        if not p.is_entered_result:
+            continue
+        for no, (top, _) in enumerate(p_accents[:len(routes)]):
+            if top > 0:
+                routes_accents_num[no] += 1
+    return routes_accents_num
+
+
+def _update_routes_score(event: Event, routes: list, json_key: str, routes_accents_num: list) -> list:
+    """ Обновляем score_json трасс без сохранения, возвращаем изменившиеся трассы """
+    changed_routes = []
+    for route, accents_num in zip(routes, routes_accents_num):
+        route_score = _calc_route_score(event=event, route=route, accents_num=accents_num)
+        if route.score_json.get(json_key) != route_score:
+            route.score_json.update({f'{json_key}': route_score})
+            changed_routes.append(route)
+    return changed_routes
+
+
+def _update_group_scores(event: Event, participants: list, routes: list, json_key: str) -> list:
+    accents = [get_participant_accents(participant=p, routes_num=len(routes)) for p in participants]
+    changed_routes = _update_routes_score(
+        event=event, routes=routes, json_key=json_key,
+        routes_accents_num=_get_routes_accents_num(event=event, participants=participants, accents=accents,
+                                                   routes=routes))
+    for p, p_accents in zip(participants, accents):
+        _update_participant_score(event=event, participant=p, routes=routes, json_key=json_key, accents=p_accents)
+    return changed_routes
+
+
+def _get_event_routes(event: Event) -> list:
+    """ Трассы соревнования списком, индекс в списке совпадает с номером трассы в french_accents """
+    return list(event.route.all().order_by('number'))
+
+
+@transaction.atomic
+def _update_results(event: Event, gender: Participant.GENDERS, group_index: int,
+                    participants: list = None, routes: list = None):
+    """ Пересчёт группы. participants и routes можно передать уже загруженными,
+    иначе они читаются из БД (по одному запросу) """
+    json_key = _get_participant_json_key(gender=gender, group_index=group_index)
+
+    if participants is None:
+        participants = list(_get_group_participants(event=event, gender=gender, group_index=group_index)
+                            .select_for_update())
+    participants_state = {p.id: _get_participant_result_state(participant=p) for p in participants}
+    if routes is None:
+        routes = _get_event_routes(event=event)
+
+    # update routes and all participants in group:
+    if settings.SCORING_ENGINE == SCORING_ENGINE_NUMPY:
+        from events import np_scoring
+        changed_routes = np_scoring.update_group_scores(event=event, participants=participants, routes=routes,
+                                                        json_key=json_key)
+    else:
+        changed_routes = _update_group_scores(event=event, participants=participants, routes=routes,
+                                              json_key=json_key)
+    Route.objects.bulk_update(changed_routes, fields=['score_json'])
 
     # update participant place:
     participants = sorted(participants, key=operator.attrgetter("score"), reverse=True)
@@ -491,41 +837,152 @@ def _update_results(event: Event, gender: Participant.GENDERS, group_index: int)
         p.place = index + 1
         if index != 0 and participants[index - 1].score == p.score:
             p.place = participants[index - 1].place
-        p.save()
+
+    changed_participants = [p for p in participants
+                            if _get_participant_result_state(participant=p) != participants_state[p.id]]
+    Participant.objects.bulk_update(changed_participants, fields=PARTICIPANT_RESULT_FIELDS)
+    if changed_routes or changed_participants:
+        bump_results_version(event_id=event.id)
 
 
 def get_form_initial_results(event: Event, participant: Participant) -> list:
     initial = []
+    accents = get_participant_accents(participant=participant, routes_num=event.routes_num)
     if event.score_type == Event.SCORE_FRENCH:
-        for i in range(event.routes_num):
-            result = participant.french_accents.get(str(i), {'top': 0, 'zone': 0})
-            initial.append({'top': str(result.get('top', 0)), 'zone': str(result.get('zone', 0))})
+        for top, zone in accents:
+            initial.append({'top': str(top), 'zone': str(zone)})
     else:
-        if participant.french_accents:
-            for i in range(event.routes_num):
-                result = participant.french_accents.get(str(i), {'top': 0}).get('top', 0)
-                accent = ACCENT_NO if result == 0 else (ACCENT_FLASH if result == 1 else ACCENT_REDPOINT)
-                initial.append({'top': accent,})
-        else:
-            initial = [{'label': i, 'accent': participant.accents.get(
-                str(i), ACCENT_NO)} for i in range(event.routes_num)]
+        for top, _ in accents:
+            accent = ACCENT_NO if top == 0 else (ACCENT_FLASH if top == 1 else ACCENT_REDPOINT)
+            initial.append({'top': accent,})
     return initial
 
 
+@transaction.atomic
 def update_results(event: Event):
+    # участники и трассы читаются один раз на весь пересчёт
+    routes = _get_event_routes(event=event)
+    groups = {}
+    # блокировка участников: пересчёты соревнования и групп не перемежаются
+    for p in event.participant.select_for_update():
+        key = (p.gender, p.group_index if event.is_separate_score_by_groups else 0)
+        groups.setdefault(key, []).append(p)
     for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE):
         for group_index, _ in enumerate(get_group_list(event=event)):
-            _update_results(event=event, gender=gender, group_index=group_index)
+            participants = groups.get((gender, group_index if event.is_separate_score_by_groups else 0), [])
+            _update_results(event=event, gender=gender, group_index=group_index,
+                            participants=participants, routes=routes)
+
 
+def _get_topped_routes(tops: list) -> set:
+    return {no for no, top in enumerate(tops) if top}
 
+
+def _is_places_consistent(rows: list) -> bool:
+    """ Места группы [(score, place), ...] совпадают с расставленными _update_results """
+    rows = sorted(rows, key=operator.itemgetter(0), reverse=True)
+    place = 0
+    for index, (score, row_place) in enumerate(rows):
+        if index == 0 or rows[index - 1][0] != score:
+            place = index + 1
+        if row_place != place:
+            return False
+    return True
+
+
+@transaction.atomic
+def _update_results_incremental(event: Event, participant: Participant, old_score: float, old_tops: list,
+                                was_entered: bool) -> bool:
+    """ Пересчитываем только результат участника и сдвигаем места в затронутом диапазоне.
+    Возвращаем False, если нужен полный пересчёт группы """
+    if participant.place == 0 or not was_entered:
+        # новый участник группы: меняется число участников (стоимость трасс SCORE_PROPORTIONAL) и места всех
+        return False
+    json_key = _get_participant_json_key(gender=participant.gender, group_index=participant.group_index)
+    group = _get_group_participants(event=event, gender=participant.gender, group_index=participant.group_index)
+    # блокировка группы до конца транзакции: сдвиги мест параллельных результатов не перемежаются
+    if not _is_places_consistent(rows=list(group.select_for_update().values_list('score', 'place'))):
+        # места устарели (смена пола участника, удаление участника): сдвигать их нельзя
+        return False
+    group = group.exclude(id=participant.id)
+
+    routes = _get_event_routes(event=event)
+    if any(json_key not in route.score_json for route in routes):
+        return False
+
+    if event.score_type == Event.SCORE_PROPORTIONAL and event.is_count_only_entered_results:
+        new_topped = _get_topped_routes(tops=participant.tops)
+        old_topped = _get_topped_routes(tops=old_tops) if was_entered else set()
+        if new_topped != old_topped:
+            return False
+
+    _update_participant_score(event=event, participant=participant, routes=routes, json_key=json_key)
+
+    new_score = participant.score
+    if new_score > old_score:
+        group.filter(score__gte=old_score, score__lt=new_score).update(place=F('place') + 1)
+    elif new_score < old_score:
+        group.filter(score__gte=new_score, score__lt=old_score).update(place=F('place') - 1)
+    participant.place = group.filter(score__gt=new_score).count() + 1
+    participant.save(update_fields=PARTICIPANT_RESULT_FIELDS)
+    return True
+
+
+@transaction.atomic
 def enter_results(event: Event, participant: Participant, accents: dict, force_update_disable: bool = False):
+    old_score, old_tops, was_entered = participant.score, participant.tops, participant.is_entered_result
+
     # save participant accents:
-    participant.french_accents = accents
+    participant.tops, participant.zones = encode_accents(french_accents=accents, routes_num=event.routes_num)
     participant.is_entered_result = True
     participant.save()
 
-    if not force_update_disable:
-        _update_results(event=event, gender=participant.gender, group_index=participant.group_index)
+    if force_update_disable:
+        return
+    if settings.RESULTS_INCREMENTAL_UPDATE and _update_results_incremental(
+            event=event, participant=participant, old_score=old_score, old_tops=old_tops,
+            was_entered=was_entered):
+        return
+    if settings.RESULTS_RECOMPUTE_DEBOUNCE:
+        # свой результат участник видит сразу, места в группе пересчитаются после паузы
+        json_key = _get_participant_json_key(gender=participant.gender, group_index=participant.group_index)
+        _update_participant_score(event=event, participant=participant, routes=_get_event_routes(event=event),
+                                  json_key=json_key)
+        participant.save(update_fields=PARTICIPANT_RESULT_FIELDS)
+        transaction.on_commit(lambda: schedule_results_update(
+            event_id=event.id, gender=participant.gender, group_index=participant.group_index))
+        return
+    _update_results(event=event, gender=participant.gender, group_index=participant.group_index)
+
+
+_scheduled_updates = {}
+_scheduled_updates_lock = threading.Lock()
+
+
+def _run_scheduled_update(event_id: int, gender: Participant.GENDERS, group_index: int) -> None:
+    with _scheduled_updates_lock:
+        # результаты, внесённые с этого момента, запланируют следующий пересчёт
+        _scheduled_updates.pop((event_id, gender, group_index), None)
+    try:
+        event = Event.objects.filter(id=event_id).first()
+        if event:
+            _update_results(event=event, gender=gender, group_index=group_index)
+    except Exception as e:
+        logger.error(f"Error updating results for event {event_id} ({gender}, {group_index}): {e}", exc_info=True)
+    finally:
+        connection.close()
+
+
+def schedule_results_update(event_id: int, gender: Participant.GENDERS, group_index: int) -> None:
+    """ Пересчёт группы через RESULTS_RECOMPUTE_DEBOUNCE секунд: все результаты, внесённые за это время,
+    обслуживает один пересчёт. Таймер не daemon - при остановке воркера запланированный пересчёт выполнится """
+    key = (event_id, gender, group_index)
+    with _scheduled_updates_lock:
+        if key in _scheduled_updates:
+            return
+        timer = threading.Timer(settings.RESULTS_RECOMPUTE_DEBOUNCE, _run_scheduled_update, args=key)
+        _scheduled_updates[key] = timer
+    timer.start()
 
 
 def get_registration_msg_html(event: Event, participant: Participant, pay_url: str) -> str:
@@ -556,14 +1013,10 @@ def _accent_attempt_to_literal(attempt: str) -> str:
     return 'RP'
 
 
-def _accents_to_string(event: Event, accents: list) -> list:
-    return [_accent_attempt_to_literal(attempt) for attempt in accents]
-
-
 def _french_accents_to_string(event: Event, accents: list) -> list:
     if event.score_type == Event.SCORE_FRENCH:
-        return [f"{result.get('top', 0)}T {result.get('zone', 0)}z" for result in accents]
-    return [_accent_attempt_to_literal(str(result.get('top', '0'))) for result in accents]
+        return [f"{top}T {zone}z" for top, zone in accents]
+    return [_accent_attempt_to_literal(str(top)) for top, _ in accents]
 
 
 def _get_score_view(participant: Participant, score_type) -> str:
@@ -574,28 +1027,52 @@ def _get_score_view(participant: Participant, score_type) -> str:
     return str(participant.score)
 
 
-def _get_sorted_participants_results(event: Event, participants: QuerySet, full_results: bool = False) -> list:
-    """ Возвращем сортированный список результатов участников из переданного списка """
-    data = []
-    for participant in participants:
-        if (not event.is_count_only_entered_results) or participant.is_entered_result:
-            accents = []
-            if participant.french_accents:
-                accents = [participant.french_accents.get(str(i), {})
-                           for i in range(event.routes_num)] if full_results else []
-                accents = _french_accents_to_string(event=event, accents=accents)
-            else:
-                accents = [participant.accents.get(str(i), ACCENT_NO)
-                           for i in range(event.routes_num)] if full_results else []
-                accents = _accents_to_string(event=event, accents=accents)
-
-            counted_routes = [True if i in participant.counted_routes else False for i in range(event.routes_num)]
-            data.append(dict(participant=participant,
-                             accents=accents,
-                             score=participant.score,
-                             score_view=_get_score_view(participant=participant, score_type=event.score_type),
-                             counted_routes=counted_routes))
-    return sorted(data, key=lambda k: (-k['score'], k['participant'].last_name), reverse=False)
+def _get_sorted_participants_results(event: Event, participants: list, full_results: bool = False) -> list:
+    """ Возвращем список результатов участников из переданного списка,
+    уже отсортированного по (-score, last_name) """
+    return [_get_participant_result(event=event, participant=participant, full_results=full_results)
+            for participant in participants]
+
+
+def _get_participant_result(event: Event, participant: Participant, full_results: bool) -> dict:
+    accents = []
+    if full_results:
+        accents = get_participant_accents(participant=participant, routes_num=event.routes_num)
+        accents = _french_accents_to_string(event=event, accents=accents)
+
+    counted = set(participant.counted_routes or [])
+    counted_routes = [i in counted for i in range(event.routes_num)]
+    return dict(participant=participant,
+                accents=accents,
+                score=participant.score,
+                score_view=_get_score_view(participant=participant, score_type=event.score_type),
+                counted_routes=counted_routes)
+
+
+def _get_results_queryset(event: Event, full_results: bool) -> QuerySet:
+    """ Участники результатов в порядке индекса participant_ranking_idx: (gender, group_index, -score, last_name) """
+    participants = event.participant.order_by('gender', 'group_index', '-score', 'last_name')
+    if event.is_count_only_entered_results:
+        participants = participants.filter(is_entered_result=True)
+    # scores нужны только для подсчёта, прохождения (tops/zones) - только для полных результатов,
+    # устаревший accents перенесён в tops/zones миграцией 0039 и не читается
+    return participants.defer('scores', 'accents') if full_results \
+        else participants.defer('scores', 'accents', 'tops', 'zones')
+
+
+def _get_results_participants(event: Event, full_results: bool) -> dict:
+    """ Участники соревнования одним запросом, разложенные по (gender, group_index) в порядке (-score, last_name) """
+    groups = {}
+    for participant in _get_results_queryset(event=event, full_results=full_results):
+        groups.setdefault((participant.gender, participant.group_index), []).append(participant)
+    return groups
+
+
+def _get_route_scores_view(event: Event, routes: list, json_key: str) -> list:
+    return [
+        f"{round(get_route_score(route=route, json_key=json_key) * (event.redpoint_points if event.score_type != Event.SCORE_GRADE else 1) * (1 + event.flash_points_pc / 100), 2)}\n"
+        f"{round(get_route_score(route=route, json_key=json_key) * (event.redpoint_points if event.score_type != Event.SCORE_GRADE else 1), 2)}"
+        for route in routes]
 
 
 def get_results(event: Event, full_results: bool = False) -> dict:
@@ -616,27 +1093,207 @@ def get_results(event: Event, full_results: bool = False) -> dict:
      """
 
     data = {}
+    groups = _get_results_participants(event=event, full_results=full_results)
+    routes = list(event.route.all().order_by('number')) if full_results else []
 
     for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE):
         gender_data = []
         for group_index, group in enumerate(get_group_list(event=event)):
             json_key = _get_participant_json_key(gender=gender, group_index=group_index)
-            scores = [
-                f"{round(get_route_score(route=route, json_key=json_key) * (event.redpoint_points if event.score_type != Event.SCORE_GRADE else 1) * (1 + event.flash_points_pc / 100), 2)}\n"
-                f"{round(get_route_score(route=route, json_key=json_key) * (event.redpoint_points if event.score_type != Event.SCORE_GRADE else 1), 2)}"
-                for route in event.route.all().order_by('number')] if full_results else []
-
             gender_data.append(dict(name=group,
                                     data=_get_sorted_participants_results(
                                         event=event,
-                                        participants=event.participant.filter(gender=gender,
-                                                                              group_index=group_index),
+                                        participants=groups.get((gender, group_index), []),
                                         full_results=full_results),
-                                    scores=scores))
+                                    scores=_get_route_scores_view(event=event, routes=routes, json_key=json_key)))
         data.update({gender: gender_data})
     return data
 
 
+def get_results_stream(event: Event, chunk_size: int = 500) -> dict:
+    """ Полные результаты в формате get_results(full_results=True) для выгрузки протокола, но data каждой группы -
+    генератор: участники группы читаются отдельным запросом через QuerySet.iterator() по мере записи
+    и не собираются в памяти все сразу """
+    routes = list(event.route.all().order_by('number'))
+    participants = _get_results_queryset(event=event, full_results=True)
+    data = {}
+    for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE):
+        data[gender] = [
+            dict(name=group,
+                 data=(_get_participant_result(event=event, participant=participant, full_results=True)
+                       for participant in participants.filter(gender=gender, group_index=group_index)
+                       .iterator(chunk_size=chunk_size)),
+                 scores=_get_route_scores_view(event=event, routes=routes,
+                                               json_key=_get_participant_json_key(gender=gender,
+                                                                                  group_index=group_index)))
+            for group_index, group in enumerate(get_group_list(event=event))]
+    return data
+
+
+RESULTS_NOTIFY_CHANNEL = 'climbing_events_results'
+
+
+_on_commit_state = threading.local()
+
+
+def _on_commit_once(func, event_id: int) -> None:
+    """ func(event_id) после commit текущей транзакции, не больше одного раза на транзакцию и соревнование.
+    Вне транзакции выполняется сразу """
+    # отметка предыдущей транзакции больше не нужна; при откате транзакции её колбэки просто не вызываются
+    _get_on_commit_done().discard((func, event_id))
+    transaction.on_commit(partial(_run_on_commit_once, func, event_id))
+
+
+def _get_on_commit_done() -> set:
+    if not hasattr(_on_commit_state, 'done'):
+        _on_commit_state.done = set()
+    return _on_commit_state.done
+
+
+def _run_on_commit_once(func, event_id: int) -> None:
+    # колбэки одной транзакции выполняются подряд сразу после commit: первый выполняет func, остальные пропускаются
+    done = _get_on_commit_done()
+    if (func, event_id) in done:
+        return
+    done.add((func, event_id))
+    func(event_id)
+
+
+def _send_results_notify(event_id: int) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_notify(%s, %s)', [RESULTS_NOTIFY_CHANNEL, str(event_id)])
+
+
+def notify_results_changed(event_id: int) -> None:
+    """ Уведомление подписчиков живых результатов (events/live.py), только при RESULTS_LIVE_PUSH.
+    Отправляется один раз после commit транзакции, поэтому подписчики читают уже сохранённые результаты """
+    if not settings.RESULTS_LIVE_PUSH or connection.vendor != 'postgresql':
+        return
+    _on_commit_once(_send_results_notify, event_id=event_id)
+
+
+def _set_results_version(event_id: int) -> None:
+    Event.objects.filter(id=event_id).update(results_version=uuid.uuid4())
+    notify_results_changed(event_id=event_id)
+
+
+def bump_results_version(event_id: int) -> None:
+    """ Новая версия результатов: ранее сохранённые снимки get_results_snapshot() больше не используются.
+    Пишется одним UPDATE после commit, сколько бы участников и трасс ни изменила транзакция,
+    поэтому строка соревнования не блокируется до конца транзакции """
+    _on_commit_once(_set_results_version, event_id=event_id)
+
+
+def get_results_etag(request, event_id: int) -> str or None:
+    """ ETag страниц и списков соревнования: версия результатов + пользователь (от него зависит шапка и права).
+    Один лёгкий запрос, до подсчёта результатов и рендера шаблона """
+    version = Event.objects.filter(id=event_id).values_list('results_version', flat=True).first()
+    if version is None:
+        return None
+    return f'{version}-{request.user.pk or 0}'
+
+
+def _get_results_snapshot_key(event_id: int) -> str:
+    return f'results_snapshot_{event_id}'
+
+
+def get_results_snapshot(event: Event) -> dict:
+    """ Полные результаты и трассы соревнования из кеша по текущей версии результатов.
+    Версия хранится в БД (Event.results_version), поэтому снимок не бывает устаревшим
+    и одинаково работает для всех процессов gunicorn.
+    Один ключ кеша на соревнование: новый снимок заменяет предыдущий, от которого остаются
+    только строки участников для get_results_changes() """
+    cache_key = _get_results_snapshot_key(event_id=event.id)
+    cached = cache.get(cache_key)
+    if cached is not None and cached['version'] == event.results_version:
+        return cached
+    snapshot = _get_results_snapshot(event=event)
+    if cached is not None:
+        snapshot['previous'] = dict(version=cached['version'], rows=_get_results_rows(snapshot=cached))
+    cache.set(cache_key, snapshot, timeout=3600)
+    return snapshot
+
+
+def _get_results_snapshot(event: Event) -> dict:
+    """ Снимок результатов из строк _get_results_row() и категорий трасс, без объектов моделей """
+    routes = [dict(number=route.number, grade=route.grade) for route in event.route.all().order_by('number')]
+    results = {}
+    for gender, groups in get_results(event=event, full_results=True).items():
+        results[gender] = []
+        for group_index, group in enumerate(groups):
+            table = _get_participant_json_key(gender=gender, group_index=group_index)
+            group = dict(name=group['name'], scores=group['scores'],
+                         data=[_get_results_row(item=item, table=table, order=order)
+                               for order, item in enumerate(group['data'])])
+            group['version'] = _get_results_table_version(group=group, routes=routes)
+            results[gender].append(group)
+    return dict(version=event.results_version, results=results, routes=routes, previous=None)
+
+
+def _get_results_table_version(group: dict, routes: list) -> str:
+    """ Отпечаток таблицы группы для кеша фрагмента sn-result-table.html: меняется только
+    при изменении её строк, FL/RP или категорий трасс, таблицы других групп остаются в кеше """
+    content = json.dumps([group['name'], group['data'], group['scores'], [route['grade'] for route in routes]],
+                         default=str)
+    return hashlib.md5(content.encode()).hexdigest()
+
+
+def _get_results_row(item: dict, table: str, order: int) -> dict:
+    """ Строка результата участника из get_results() в виде, пригодном для JSON """
+    participant = item['participant']
+    return dict(id=participant.id, table=table, order=order, place=participant.place,
+                name=f'{participant.last_name} {participant.first_name}',
+                accents=item['accents'], counted_routes=item['counted_routes'],
+                score=item['score'], score_view=item['score_view'])
+
+
+def _get_results_rows(snapshot: dict) -> dict:
+    """ Строки всех участников снимка по id """
+    return {row['id']: row
+            for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE)
+            for group in snapshot['results'][gender]
+            for row in group['data']}
+
+
+def get_results_live_state(event: Event) -> dict:
+    """ Состояние страницы результатов для живого обновления:
+    layout - всё, что меняет разметку (при изменении страница перезагружается),
+    rows - строки участников по id, scores - строки FL/RP по таблицам """
+    snapshot = get_results_snapshot(event=event)
+    scores = {_get_participant_json_key(gender=gender, group_index=group_index): group['scores']
+              for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE)
+              for group_index, group in enumerate(snapshot['results'][gender])}
+    layout = [event.is_published, event.is_results_allowed, event.is_view_full_results, event.is_view_route_grade,
+              event.is_view_route_score, event.score_type, event.group_list, event.group_num,
+              [route['grade'] for route in snapshot['routes']]]
+    return dict(layout=layout, rows=_get_results_rows(snapshot=snapshot), scores=scores)
+
+
+def get_results_json(event: Event) -> dict:
+    """ get_results(full_results=True) в виде JSON: участники заменены строками _get_results_row() """
+    return {gender: [dict(name=group['name'], data=group['data'], scores=group['scores']) for group in groups]
+            for gender, groups in get_results_snapshot(event=event)['results'].items()}
+
+
+def get_results_changes(event: Event, since: str) -> dict or None:
+    """ Строки участников, изменившиеся после версии результатов since, и id выбывших из результатов.
+    None - since не текущая и не предыдущая версия (неизвестная или устаревшая), нужен полный ответ """
+    try:
+        since = uuid.UUID(since)
+    except ValueError:
+        return None
+    snapshot = get_results_snapshot(event=event)
+    rows = _get_results_rows(snapshot=snapshot)
+    if since == snapshot['version']:
+        old_rows = rows
+    elif snapshot['previous'] is not None and since == snapshot['previous']['version']:
+        old_rows = snapshot['previous']['rows']
+    else:
+        return None
+    return dict(changed=[row for participant_id, row in rows.items() if old_rows.get(participant_id) != row],
+                removed=[participant_id for participant_id in old_rows if participant_id not in rows])
+
+
 # ================================================
 # ============== Excel responses =================
 # ================================================
@@ -651,7 +1308,8 @@ def get_startlist_response(event: Event) -> HttpResponse:
 
 
 def get_result_response(event: Event) -> HttpResponse:
-    book = xl_tools.export_result(event=event)
+    with open(xl_tools.export_result(event=event), 'rb') as file:
+        book = file.read()
     response = HttpResponse(content=book,
                             content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     response['Content-Disposition'] = 'attachment; filename=result.xlsx'
@@ -723,6 +1381,92 @@ def get_maintenance_context(request):
     return {'code': '', 'msg': 'Сервер на обслуживании'}
 
 
+# ================================================
+# ================ Protocol jobs =================
+# ================================================
+
+
+PROTOCOL_JOB_MAX_ATTEMPTS = 3
+# пауза перед повтором, умножается на номер попытки, сек
+PROTOCOL_JOB_RETRY_DELAY = 30
+# задание в RUNNING дольше этого времени считаем брошенным (воркер перезапущен), сек
+PROTOCOL_JOB_TIMEOUT = 15 * 60
+
+
+def enqueue_protocol_job(event: Event) -> ProtocolJob:
+    """ Ставит формирование протокола в очередь. Пока задание соревнования ждёт в очереди,
+    повторные запросы присоединяются к нему """
+    job = event.protocol_job.filter(status=ProtocolJob.STATUS_PENDING).first()
+    if job:
+        return job
+    try:
+        with transaction.atomic():
+            return ProtocolJob.objects.create(event=event)
+    except IntegrityError:
+        # задание только что создал параллельный запрос (unique_pending_protocol_job)
+        return event.protocol_job.order_by('-created').first()
+
+
+def claim_protocol_job() -> ProtocolJob or None:
+    """ Забирает из очереди следующее задание. skip_locked - несколько воркеров не берут одно задание """
+    with transaction.atomic():
+        job = ProtocolJob.objects.select_for_update(skip_locked=True).filter(
+            status=ProtocolJob.STATUS_PENDING, run_after__lte=timezone.now()).order_by('run_after').first()
+        if job is None:
+            return None
+        job.status = ProtocolJob.STATUS_RUNNING
+        job.started = timezone.now()
+        job.progress = 0
+        job.attempts += 1
+        job.save(update_fields=['status', 'started', 'progress', 'attempts'])
+    return job
+
+
+def _fail_protocol_job(job: ProtocolJob, error: str) -> None:
+    job.error = error
+    job.finished = timezone.now()
+    job.status = ProtocolJob.STATUS_FAILED
+    if job.attempts < PROTOCOL_JOB_MAX_ATTEMPTS:
+        job.status = ProtocolJob.STATUS_PENDING
+        job.run_after = timezone.now() + timedelta(seconds=PROTOCOL_JOB_RETRY_DELAY * job.attempts)
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        # в очереди уже есть новое задание этого соревнования, повтор не нужен
+        job.status = ProtocolJob.STATUS_FAILED
+        job.save()
+
+
+def run_protocol_job(job: ProtocolJob) -> None:
+    def on_progress(percent: int) -> None:
+        ProtocolJob.objects.filter(id=job.id).update(progress=percent)
+
+    try:
+        file = xl_tools.export_result(event=job.event, on_progress=on_progress)
+    except Exception as e:
+        logger.error(f"Error exporting results for event {job.event_id}, attempt {job.attempts}: {e}",
+                     exc_info=True)
+        _fail_protocol_job(job=job, error=str(e))
+        return
+    job.status = ProtocolJob.STATUS_DONE
+    job.progress = 100
+    job.file = os.path.basename(file)
+    job.finished = timezone.now()
+    job.save()
+
+
+def requeue_stale_protocol_jobs() -> None:
+    stale = ProtocolJob.objects.filter(status=ProtocolJob.STATUS_RUNNING,
+                                       started__lt=timezone.now() - timedelta(seconds=PROTOCOL_JOB_TIMEOUT))
+    for job in stale:
+        _fail_protocol_job(job=job, error='Протокол не сформирован за отведённое время')
+
+
+def get_protocol_jobs(event: Event, num: int = 5) -> list:
+    return list(event.protocol_job.order_by('-created')[:num])
+
+
 # ================================================
 # =================== Files ======================
 # ================================================
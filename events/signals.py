@@ -0,0 +1,69 @@
+import uuid
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from events import services
+from events.models import Event, Participant, Route
+
+
+@receiver(pre_save, sender=Event)
+def event_pre_save(sender, instance: Event, **kwargs):
+    # новая версия пишется тем же запросом, что и изменения соревнования
+    instance.results_version = uuid.uuid4()
+
+
+@receiver(post_save, sender=Event)
+def event_post_save(sender, instance: Event, update_fields=None, **kwargs):
+    if update_fields is not None and 'results_version' not in update_fields:
+        services.bump_results_version(event_id=instance.id)
+    else:
+        services.notify_results_changed(event_id=instance.id)
+
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+@receiver(post_save, sender=Route)
+@receiver(post_delete, sender=Route)
+def results_data_changed(sender, instance, **kwargs):
+    # только планирует новую версию: один UPDATE соревнования после commit на всю транзакцию
+    services.bump_results_version(event_id=instance.event_id)
+
+
+@receiver(post_save, sender=Participant)
+def participant_counters_post_save(sender, instance: Participant, created, update_fields=None, **kwargs):
+    if not services.is_participant_counters_enabled():
+        return
+    if update_fields is not None and not set(update_fields).intersection(Participant.COUNTED_FIELDS):
+        return
+    new_state = instance.get_counted_state()
+    old_state = None if created else getattr(instance, 'counted_state', None)
+    if new_state is None or (old_state is None and not created):
+        # прежнее состояние неизвестно (объект собран не из БД или поля отложены) - считаем заново
+        services.rebuild_participant_counters(event_id=instance.event_id)
+    else:
+        services.update_participant_counters(event_id=instance.event_id, old_state=old_state, new_state=new_state)
+    instance.counted_state = instance.get_counted_state()
+
+
+@receiver(post_delete, sender=Participant)
+def participant_counters_post_delete(sender, instance: Participant, **kwargs):
+    if not services.is_participant_counters_enabled():
+        return
+    old_state = getattr(instance, 'counted_state', None) or instance.get_counted_state()
+    if old_state is None:
+        services.rebuild_participant_counters(event_id=instance.event_id)
+    else:
+        services.update_participant_counters(event_id=instance.event_id, old_state=old_state, new_state=None)
+
+
+@receiver(post_save, sender=Participant)
+def route_results_post_save(sender, instance: Participant, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'tops' not in update_fields:
+        return
+    new_state = instance.get_compact_state()
+    old_state = ((), ()) if created else getattr(instance, 'compact_state', None)
+    if new_state is not None and new_state == old_state:
+        return
+    services.sync_route_results(participant=instance)
+    instance.compact_state = new_state
@@ -25,4 +25,55 @@ function page_reload() {
     setTimeout(() => {
         document.location.reload();
       }, 10000);
-}
\ No newline at end of file
+}
+
+function results_live(url) {
+    if (!window.EventSource) {
+        page_reload();
+        return;
+    }
+    const source = new EventSource(url);
+    source.addEventListener("results", (e) => {
+        if (!apply_results_delta(JSON.parse(e.data))) {
+            source.close();
+            document.location.reload();
+        }
+    });
+}
+
+function apply_results_delta(delta) {
+    // false - изменения нельзя применить на месте, нужна перезагрузка страницы
+    if (delta.reload || delta.removed.length) {
+        return false;
+    }
+    const tables = new Set();
+    for (const row of delta.rows) {
+        const tr = document.querySelector(`tr[data-participant="${row.id}"]`);
+        if (!tr || tr.closest("table").dataset.table !== row.table) {
+            return false;
+        }
+        tr.dataset.order = row.order;
+        tr.querySelector(".js-place").textContent = row.place;
+        tr.querySelector(".js-name").textContent = row.name;
+        tr.querySelector(".js-score").textContent = row.score_view;
+        tr.querySelectorAll(".js-accent").forEach((td, i) => {
+            td.className = `align-middle js-accent accent_${row.accents[i]}` +
+                (row.counted_routes[i] ? "" : " accent_not_counted");
+            td.querySelector("p").textContent = row.accents[i];
+        });
+        tables.add(tr.closest("tbody"));
+    }
+    for (const [table, scores] of Object.entries(delta.scores)) {
+        document.querySelectorAll(`table[data-table="${table}"] .js-route-score`).forEach((td, i) => {
+            td.querySelector("em").textContent = scores[i];
+        });
+    }
+    // строки таблицы в порядке мест
+    for (const tbody of tables) {
+        const rows = Array.from(tbody.querySelectorAll("tr[data-participant]"));
+        const footer = tbody.querySelector(".js-route-scores");
+        rows.sort((a, b) => a.dataset.order - b.dataset.order);
+        rows.forEach((tr) => tbody.insertBefore(tr, footer));
+    }
+    return true;
+}
@@ -1,12 +1,17 @@
 from datetime import datetime, date
+from unittest import mock, skipUnless
 from django.test import TestCase, TransactionTestCase, Client
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
 from django.urls import reverse
+from django.db import connection, transaction
 from django.db.utils import IntegrityError
-from events.models import CustomUser, Event, Participant, Route, Wallet, PromoCode, PayDetail
-from events import services
+from django.test.utils import CaptureQueriesContext
+from config import settings
+from events.models import CustomUser, Event, Participant, Route, Wallet, PromoCode, PayDetail, ProtocolJob
+from events import live, services, xl_tools
 from events.forms import ParticipantRegistrationForm, CreateEventForm
-from events.exceptions import DuplicateParticipantError, ParticipantTooYoungError
+from events.exceptions import DuplicateParticipantError, ParticipantTooYoungError, RegistrationFullError
 
 class ClimbingEventsBaseTestCase(TestCase):
     def setUp(self):
@@ -74,6 +79,25 @@ class ServicesTestCase(ClimbingEventsBaseTestCase):
         self.assertEqual(event.routes_num, 10)
         self.assertEqual(Route.objects.filter(event=event).count(), 10)
 
+    def test_resize_event_routes_keeps_surviving_routes(self):
+        event = services.create_event(owner=self.superuser, title="Resize Event", date=datetime(2026, 10, 1))
+        event.route.filter(number=2).update(grade='6A', color='#00FF00')
+        participant = Participant.objects.create(
+            first_name='A', last_name='B', event=event, pin=1001, is_entered_result=True,
+            french_accents={'1': {'top': 1, 'zone': 1}, '8': {'top': 2, 'zone': 1}})
+
+        event.routes_num = 5
+        services.resize_event_routes(event=event)
+        self.assertEqual(list(event.route.order_by('number').values_list('number', flat=True)), [1, 2, 3, 4, 5])
+        self.assertEqual(event.route.get(number=2).grade, '6A')
+        participant.refresh_from_db()
+        self.assertEqual(participant.french_accents, {'1': {'top': 1, 'zone': 1}})
+
+        event.routes_num = 7
+        services.resize_event_routes(event=event)
+        self.assertEqual(list(event.route.order_by('number').values_list('number', flat=True)), list(range(1, 8)))
+        self.assertEqual(event.route.get(number=2).color, '#00FF00')
+
     def test_group_and_set_lists(self):
         event = services.create_event(owner=self.superuser, title="Test Lists", date=datetime(2026, 10, 1))
         event.group_num = 2
@@ -87,14 +111,36 @@ class ServicesTestCase(ClimbingEventsBaseTestCase):
 
     def test_clear_event(self):
         event = services.create_event(owner=self.superuser, title="Clear Event", date=datetime(2026, 10, 1))
-        Participant.objects.create(first_name='A', last_name='B', event=event, pin=1234)
+        Participant.objects.create(first_name='A', last_name='B', event=event, pin=1234,
+                                   french_accents={"0": {"top": 1, "zone": 1}})
         
         self.assertEqual(Route.objects.filter(event=event).count(), 10)
         self.assertEqual(Participant.objects.filter(event=event).count(), 1)
+        self.assertEqual(event.route_result.count(), 1)
 
         services.clear_event(event)
         self.assertEqual(Participant.objects.filter(event=event).count(), 0)
         self.assertEqual(Route.objects.filter(event=event).count(), 10)
+        self.assertEqual(services.get_participant_counters(event=event)['total'], 0)
+        # RouteResult удалены каскадом вместе с участниками и трассами
+        self.assertFalse(event.route_result.exists())
+
+    def test_clear_results_resets_scores_in_place(self):
+        event = services.create_event(owner=self.superuser, title="Clear Results", date=datetime(2026, 10, 1))
+        services.debug_create_participants(event=event, num=20)
+        services.debug_apply_random_results(event=event)
+        version = Event.objects.get(id=event.id).results_version
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            services.clear_results(event)
+        # без запросов на каждого участника и трассу
+        self.assertLess(len(queries), 10)
+        self.assertFalse(event.participant.exclude(score=0).exists())
+        self.assertFalse(event.participant.filter(is_entered_result=True).exists())
+        self.assertFalse(event.participant.exclude(tops=[]).exists())
+        self.assertFalse(event.route.exclude(score_json={}).exists())
+        self.assertEqual(services.get_participant_counters(event=event)['entered'], 0)
+        self.assertNotEqual(Event.objects.get(id=event.id).results_version, version)
 
     def test_is_registration_open_published_logic(self):
         event = services.create_event(owner=self.superuser, title="Reg Event", date=datetime(2026, 10, 1))
@@ -158,6 +204,129 @@ class ServicesTestCase(ClimbingEventsBaseTestCase):
         with self.assertRaises(DuplicateParticipantError):
             services.register_participant(event, data_valid)
 
+    def test_participant_pin_allocation(self):
+        event = services.create_event(owner=self.superuser, title="Pin Event", date=datetime(2026, 10, 1))
+        pool = services._get_event_pin_pool(event_id=event.id)
+        # PIN первого кандидата уже занят вручную - берётся следующий свободный
+        Participant.objects.create(first_name='A', last_name='B', event=event, pin=pool[1])
+        participant = services._create_participant(event=event, first_name='C', last_name='D')
+        self.assertEqual(participant.pin, pool[2])
+
+        services.debug_create_participants(event=event, num=50)
+        pins = list(event.participant.values_list('pin', flat=True))
+        self.assertEqual(len(pins), len(set(pins)))
+        self.assertTrue(all(1000 <= pin <= 9999 for pin in pins))
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Participant.objects.create(first_name='E', last_name='F', event=event, pin=participant.pin)
+
+    def test_participant_counters(self):
+        event = services.create_event(owner=self.superuser, title="Counters Event", date=datetime(2026, 10, 1))
+        p1 = Participant.objects.create(first_name='A', last_name='B', event=event, pin=1001, set_index=1)
+        Participant.objects.create(first_name='C', last_name='D', event=event, pin=1002, group_index=2)
+        p1.is_entered_result = True
+        p1.save()
+        p1 = Participant.objects.get(id=p1.id)
+        p1.paid = True
+        p1.set_index = 0
+        p1.save()
+        counters = services.get_participant_counters(event=event)
+        self.assertEqual(counters['total'], 2)
+        self.assertEqual(counters['entered'], 1)
+        self.assertEqual(counters['paid'], 1)
+        self.assertEqual(counters['sets'], {0: 2, 1: 0})
+        self.assertEqual(counters['groups'], {0: 1, 2: 1})
+
+        p1.delete()
+        counters = services.get_participant_counters(event=event)
+        self.assertEqual((counters['total'], counters['entered'], counters['paid']), (1, 0, 0))
+
+        # объект без состояния из БД - счётчики пересчитываются по таблице
+        Participant(id=event.participant.get().id, first_name='C', last_name='D', event=event, pin=1002).save()
+        self.assertEqual(services.get_participant_counters(event=event)['groups'], {0: 1})
+
+        event.is_published = True
+        event.is_registration_open = True
+        event.set_max_participants = 1
+        with self.assertNumQueries(1):
+            self.assertFalse(services.is_registration_open(event=event))
+
+    def test_participants_charts_single_query(self):
+        event = services.create_event(owner=self.superuser, title="Charts Event", date=datetime(2026, 10, 1))
+        event.set_num = 2
+        event.set_list = 'S1, S2'
+        event.group_num = 2
+        event.group_list = 'G1, G2'
+        event.save()
+        Participant.objects.create(first_name='A', last_name='A', event=event, pin=1001, city='Омск', set_index=1)
+        Participant.objects.create(first_name='B', last_name='B', event=event, pin=1002, city='Омск', group_index=1)
+        Participant.objects.create(first_name='C', last_name='C', event=event, pin=1003, city='Томск', set_index=1)
+        Participant.objects.create(first_name='D', last_name='D', event=event, pin=1004, city=None)
+        with self.assertNumQueries(1):
+            charts = services.get_participants_charts(event=event)
+        self.assertEqual(charts['set'], {'labels': ['S1', 'S2'], 'data': [2, 2]})
+        self.assertEqual(charts['group'], {'labels': ['G1', 'G2'], 'data': [3, 1]})
+        # участники без города, как и раньше, в гистограмме с нулём
+        self.assertEqual(charts['city'], {'labels': ['Омск', 'Томск', 'None'], 'data': [2, 1, 0]})
+
+    def test_start_list_export_write_only_matches_template_copy(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+        event = services.create_event(owner=self.superuser, title="Export Event", date=datetime(2026, 10, 1))
+        services.debug_create_participants(event=event, num=15)
+        books = [load_workbook(BytesIO(xl_tools.export_participants_to_start_list(event=event, write_only=write_only)))
+                 for write_only in (False, True)]
+        self.assertEqual(books[0].sheetnames, books[1].sheetnames)
+        for template_copy, write_only in zip(books[0].worksheets, books[1].worksheets):
+            self.assertEqual([[cell.value for cell in row] for row in template_copy.iter_rows(max_col=13)],
+                             [[cell.value for cell in row] for row in write_only.iter_rows(max_col=13)])
+            self.assertEqual(template_copy.merged_cells.ranges, write_only.merged_cells.ranges)
+            self.assertTrue(write_only['A7'].font.b)
+
+    def test_results_stream_matches_get_results(self):
+        event = services.create_event(owner=self.superuser, title="Stream Event", date=datetime(2026, 10, 1))
+        event.group_num = 2
+        event.group_list = 'A, B'
+        event.save()
+        services.debug_create_participants(event=event, num=30)
+        services.debug_apply_random_results(event=event)
+        full = services.get_results(event=event, full_results=True)
+        stream = services.get_results_stream(event=event)
+        for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE):
+            for group, streamed in zip(full[gender], stream[gender]):
+                self.assertEqual(group['scores'], streamed['scores'])
+                self.assertEqual([(item['participant'].id, item['accents'], item['score_view'])
+                                  for item in group['data']],
+                                 [(item['participant'].id, item['accents'], item['score_view'])
+                                  for item in streamed['data']])
+
+    def test_get_results_ranking_order(self):
+        event = services.create_event(owner=self.superuser, title="Ranking Event", date=datetime(2026, 10, 1))
+        Participant.objects.create(first_name='A', last_name='Яковлев', event=event, pin=1001, score=50,
+                                   is_entered_result=True, counted_routes=[1])
+        Participant.objects.create(first_name='B', last_name='Антонов', event=event, pin=1002, score=50,
+                                   is_entered_result=True, counted_routes=[0, 2])
+        Participant.objects.create(first_name='C', last_name='Борисов', event=event, pin=1003, score=70,
+                                   is_entered_result=True)
+        data = services.get_results(event=event, full_results=True)[Participant.GENDER_MALE][0]['data']
+        self.assertEqual([item['participant'].last_name for item in data], ['Борисов', 'Антонов', 'Яковлев'])
+        self.assertEqual(data[1]['counted_routes'][:3], [True, False, True])
+
+    def test_get_results_query_count_is_constant(self):
+        event = services.create_event(owner=self.superuser, title="Queries Event", date=datetime(2026, 10, 1))
+        event.group_num = 3
+        event.group_list = 'A, B, C'
+        event.is_count_only_entered_results = False
+        event.save()
+        services.debug_create_participants(event=event, num=30)
+        with self.assertNumQueries(2):
+            full = services.get_results(event=event, full_results=True)
+        with self.assertNumQueries(1):
+            short = services.get_results(event=event)
+        self.assertEqual(len(full[Participant.GENDER_FEMALE]), 3)
+        self.assertEqual([[len(group['data']) for group in short[gender]] for gender in short],
+                         [[len(group['data']) for group in full[gender]] for gender in full])
+
     def test_calculate_results_simple_sum(self):
         event = services.create_event(owner=self.superuser, title="Simple Sum Event", date=datetime(2026, 10, 1))
         event.score_type = Event.SCORE_SIMPLE_SUM
@@ -311,6 +480,432 @@ class ServicesTestCase(ClimbingEventsBaseTestCase):
         # score = 10000*1 + 1000*1 + 100*(100-2) + 10*(100-3) = 10000 + 1000 + 9800 + 970 = 21770
         self.assertEqual(p1.score, 21770.0)
 
+    def test_update_results_bulk_persistence(self):
+        event = services.create_event(owner=self.superuser, title="Bulk Event", date=datetime(2026, 10, 1))
+        event.score_type = Event.SCORE_PROPORTIONAL
+        event.save()
+        for i in range(20):
+            Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}', gender=Participant.GENDER_MALE,
+                                       event=event, pin=3000 + i, is_entered_result=True,
+                                       french_accents={str(no): {'top': (i + no) % 3, 'zone': 1} for no in range(10)})
+
+        with CaptureQueriesContext(connection) as ctx:
+            services.update_results(event=event)
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len([sql for sql in updates if sql.startswith('UPDATE "events_participant"')]), 1)
+        # one bulk update of routes per gender
+        self.assertEqual(len([sql for sql in updates if sql.startswith('UPDATE "events_route"')]), 2)
+
+        # nothing changed - nothing to write
+        with CaptureQueriesContext(connection) as ctx:
+            services.update_results(event=event)
+        self.assertFalse([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')])
+
+    def test_update_results_select_count_is_constant(self):
+        event = services.create_event(owner=self.superuser, title="Select Event", date=datetime(2026, 10, 1))
+        event.score_type = Event.SCORE_PROPORTIONAL
+        event.save()
+
+        def count_selects() -> int:
+            with CaptureQueriesContext(connection) as ctx:
+                services.update_results(event=event)
+            return len([q for q in ctx.captured_queries if q['sql'].startswith('SELECT')])
+
+        for i in range(30):
+            Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}', gender=Participant.GENDER_FEMALE,
+                                       event=event, pin=4000 + i, is_entered_result=True,
+                                       french_accents={str(no): {'top': (i + no) % 3} for no in range(10)})
+        # участники и трассы - по одному запросу на весь пересчёт
+        self.assertEqual(count_selects(), 2)
+        for i in range(30, 60):
+            Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}', gender=Participant.GENDER_MALE,
+                                       event=event, pin=4000 + i, is_entered_result=True)
+        self.assertEqual(count_selects(), 2)
+
+    def test_compact_accents_follow_json(self):
+        event = services.create_event(owner=self.superuser, title="Compact Event", date=datetime(2026, 10, 1))
+        participant = Participant.objects.create(first_name='P', last_name='L', gender=Participant.GENDER_MALE,
+                                                 event=event, pin=5000,
+                                                 french_accents={"0": {"top": 2, "zone": 1}, "2": {"top": 1},
+                                                                 "3": {"top": 0, "zone": 0}})
+        participant.refresh_from_db()
+        # длина списков - число трасс соревнования
+        self.assertEqual((participant.tops, participant.zones), ([2, 0, 1] + [0] * 7, [1, 0, 0] + [0] * 7))
+        self.assertEqual(services.get_participant_accents(participant=participant, routes_num=4),
+                         [(2, 1), (0, 0), (1, 0), (0, 0)])
+
+        self.assertEqual(participant.french_accents, {"0": {"top": 2, "zone": 1}, "2": {"top": 1, "zone": 0}})
+
+        participant.french_accents = {"1": {"top": 0, "zone": 4}}
+        participant.save(update_fields=['tops', 'zones'])
+        participant.refresh_from_db()
+        self.assertEqual((participant.tops, participant.zones), ([0] * 10, [0, 4] + [0] * 8))
+
+        # номер трассы вне 0..routes_num - 1 или неверные попытки - ValueError
+        for accents in ({"10": {"top": 1}}, {"-1": {"top": 1}}, {"1.5": {"top": 1}}, {"0": "T"}, {"0": {"top": -1}}):
+            with self.subTest(accents=accents), self.assertRaises(ValueError):
+                services.enter_results(event=event, participant=participant, accents=accents)
+
+    def test_route_results_follow_accents(self):
+        event = services.create_event(owner=self.superuser, title="Route Results Event", date=datetime(2026, 10, 1))
+        event.score_type = Event.SCORE_PROPORTIONAL
+        event.is_count_only_entered_results = True
+        event.save()
+        cards = [
+            {"0": {"top": 1, "zone": 1}, "1": {"top": 3, "zone": 2}},
+            {"0": {"top": 2, "zone": 1}, "2": {"top": 0, "zone": 1}},
+            {"0": {"top": 4, "zone": 1}},
+        ]
+        participants = []
+        for i, card in enumerate(cards):
+            participant = Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}', event=event,
+                                                     gender=Participant.GENDER_MALE, pin=6000 + i)
+            services.enter_results(event=event, participant=participant, accents=card, force_update_disable=True)
+            participants.append(participant)
+        # участник без внесённых результатов не учитывается
+        Participant.objects.filter(id=participants[2].id).update(is_entered_result=False)
+        self.assertEqual(event.route_result.count(), 5)
+
+        with self.assertNumQueries(1):
+            stats = services.get_route_stats(event=event, gender=Participant.GENDER_MALE)
+        self.assertEqual(stats[:3], [{'number': 1, 'tops': 2, 'flashes': 1, 'zones': 2},
+                                     {'number': 2, 'tops': 1, 'flashes': 0, 'zones': 1},
+                                     {'number': 3, 'tops': 0, 'flashes': 0, 'zones': 1}])
+        # те же пролазы, что и при подсчёте PROP в Python
+        participants = list(event.participant.order_by('pin'))
+        routes = list(event.route.order_by('number'))
+        accents = [services.get_participant_accents(participant=p, routes_num=len(routes)) for p in participants]
+        self.assertEqual([route['tops'] for route in stats],
+                         services._get_routes_accents_num(event=event, participants=participants, accents=accents,
+                                                          routes=routes))
+
+        leaderboard = services.get_route_leaderboard(route=routes[0])
+        self.assertEqual([row['participant_id'] for row in leaderboard], [p.id for p in participants])
+
+        # изменение прохождений пересобирает строки участника, прочие сохранения их не трогают
+        services.enter_results(event=event, participant=participants[0], accents={"4": {"top": 1, "zone": 1}},
+                               force_update_disable=True)
+        self.assertEqual(list(participants[0].route_result.values_list('route__number', 'top')), [(5, 1)])
+        with CaptureQueriesContext(connection) as ctx:
+            participants[1].paid = True
+            participants[1].save()
+        self.assertFalse([q for q in ctx.captured_queries if 'events_routeresult' in q['sql']])
+
+        # backfill из french_accents даёт те же строки
+        before = set(event.route_result.values_list('participant_id', 'route_id', 'top', 'zone'))
+        event.route_result.all().delete()
+        self.assertEqual(services.rebuild_route_results(event_id=event.id), len(before))
+        self.assertEqual(set(event.route_result.values_list('participant_id', 'route_id', 'top', 'zone')), before)
+
+        services.clear_results(event=event)
+        self.assertFalse(event.route_result.exists())
+
+    def test_proportional_routes_accents_num(self):
+        event = Event(score_type=Event.SCORE_PROPORTIONAL, is_count_only_entered_results=True, routes_num=3)
+        routes = [Route(number=no + 1) for no in range(3)]
+        participants = [
+            Participant(event=event, is_entered_result=True, french_accents={"0": {"top": 1}, "1": {"top": 3}}),
+            Participant(event=event, is_entered_result=True,
+                        french_accents={"0": {"top": 2}, "2": {"top": 0, "zone": 1}}),
+            Participant(event=event, is_entered_result=False, french_accents={"2": {"top": 1}}),
+        ]
+        accents = [services.get_participant_accents(participant=p, routes_num=len(routes)) for p in participants]
+        self.assertEqual(services._get_routes_accents_num(event=event, participants=participants, accents=accents,
+                                                          routes=routes), [2, 1, 0])
+
+
+class IncrementalResultsTestCase(ClimbingEventsBaseTestCase):
+    def _create_event(self, score_type: str) -> Event:
+        event = services.create_event(owner=self.superuser, title="Incremental Event", date=datetime(2026, 10, 1))
+        event.score_type = score_type
+        event.is_published = True
+        event.save()
+        for i in range(5):
+            Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}', gender=Participant.GENDER_MALE,
+                                       event=event, pin=2000 + i)
+        services.update_results(event=event)
+        return event
+
+    @staticmethod
+    def _snapshot(event: Event) -> dict:
+        return {p.id: (p.score, p.place) for p in event.participant.all()}
+
+    def _enter_and_compare(self, event: Event, cards: list) -> None:
+        participants = list(event.participant.all().order_by('pin'))
+        for index, card in cards:
+            participant = Participant.objects.get(id=participants[index].id)
+            services.enter_results(event=event, participant=participant, accents=card)
+        incremental = self._snapshot(event)
+        services.update_results(event=event)
+        self.assertEqual(incremental, self._snapshot(event))
+
+    def test_incremental_places_match_full_recompute(self):
+        cards = [
+            (0, {0: {'top': 1, 'zone': 1}, 1: {'top': 2, 'zone': 1}}),
+            (1, {0: {'top': 2, 'zone': 2}}),
+            (2, {0: {'top': 1, 'zone': 1}, 1: {'top': 2, 'zone': 1}}),
+            (0, {0: {'top': 0, 'zone': 0}}),
+            (3, {2: {'top': 3, 'zone': 1}, 3: {'top': 1, 'zone': 1}}),
+        ]
+        for score_type in (Event.SCORE_SIMPLE_SUM, Event.SCORE_NUM_ACCENTS, Event.SCORE_FRENCH,
+                           Event.SCORE_GRADE, Event.SCORE_PROPORTIONAL):
+            with self.subTest(score_type=score_type):
+                self._enter_and_compare(event=self._create_event(score_type=score_type), cards=cards)
+
+    def test_new_participant_falls_back_to_full_recompute(self):
+        event = self._create_event(score_type=Event.SCORE_PROPORTIONAL)
+        event.is_count_only_entered_results = False
+        event.save()
+        self._enter_and_compare(event=event, cards=[(0, {0: {'top': 1, 'zone': 1}})])
+        # зарегистрировался после пересчёта: место 0, стоимость трасс ещё посчитана на 5 участников
+        Participant.objects.create(first_name='P5', last_name='L5', gender=Participant.GENDER_MALE,
+                                   event=event, pin=2005)
+        self._enter_and_compare(event=event, cards=[(5, {0: {'top': 1, 'zone': 1}, 1: {'top': 2, 'zone': 1}})])
+
+    def test_settings_change_recomputes_results(self):
+        event = self._create_event(score_type=Event.SCORE_PROPORTIONAL)
+        participant = event.participant.order_by('pin').first()
+        services.enter_results(event=event, participant=participant, accents={0: {'top': 1, 'zone': 1}})
+        cd = {field: getattr(event, field) for field in (
+            'routes_num', 'is_published', 'is_registration_open', 'registration_close_datetime',
+            'is_enter_result_allowed', 'is_results_allowed', 'is_count_only_entered_results',
+            'is_view_full_results', 'is_view_route_color', 'is_view_route_grade', 'is_view_route_score',
+            'is_separate_score_by_groups', 'score_type', 'redpoint_points', 'flash_points_pc',
+            'count_routes_num', 'group_num', 'group_list', 'set_num', 'set_list', 'set_max_participants',
+            'registration_fields', 'required_fields', 'is_without_registration',
+            'is_view_pin_after_registration', 'is_check_result_before_enter', 'is_update_result_allowed',
+            'participant_min_age', 'reg_type_list')}
+        cd['is_count_only_entered_results'] = not event.is_count_only_entered_results
+        services.update_event_settings(event=event, cd=cd)
+        updated = self._snapshot(event)
+        services.update_results(event=event)
+        self.assertEqual(updated, self._snapshot(event))
+
+    def test_gender_change_and_delete_keep_places(self):
+        event = self._create_event(score_type=Event.SCORE_SIMPLE_SUM)
+        participants = list(event.participant.order_by('pin'))
+        for index, participant in enumerate(participants):
+            services.enter_results(event=event, participant=participant,
+                                   accents={no: {'top': 1, 'zone': 1} for no in range(index)})
+        # смена пола пересчитывает обе группы
+        services.update_participant(event=event, participant=Participant.objects.get(id=participants[4].id),
+                                    cd={Event.FIELD_GENDER: Participant.GENDER_FEMALE})
+        self._enter_and_compare(event=event, cards=[(3, {0: {'top': 1, 'zone': 1}})])
+        # удаление участника оставляет пропуск в местах группы - инкрементальный сдвиг не применяется
+        Participant.objects.get(id=participants[2].id).delete()
+        self._enter_and_compare(event=event, cards=[(0, {0: {'top': 1, 'zone': 1}})])
+
+    def test_places_consistency(self):
+        self.assertTrue(services._is_places_consistent(rows=[(1.0, 3), (3.0, 1), (1.0, 3), (2.0, 2)]))
+        self.assertFalse(services._is_places_consistent(rows=[(3.0, 1), (1.0, 3)]))
+        self.assertFalse(services._is_places_consistent(rows=[(3.0, 1), (2.0, 0)]))
+
+    def test_incremental_writes_only_submitting_participant(self):
+        event = self._create_event(score_type=Event.SCORE_SIMPLE_SUM)
+        participant = event.participant.first()
+        # первый результат участника - полный пересчёт, следующие - инкрементальные
+        services.enter_results(event=event, participant=participant, accents={0: {'top': 2, 'zone': 1}})
+        with CaptureQueriesContext(connection) as ctx:
+            services.enter_results(event=event, participant=participant, accents={0: {'top': 1, 'zone': 1}})
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertFalse([sql for sql in updates if sql.startswith('UPDATE "events_route"')])
+        self.assertLess(len([sql for sql in updates if sql.startswith('UPDATE "events_participant"')]),
+                        event.participant.count())
+
+
+class ScoringEngineTestCase(ClimbingEventsBaseTestCase):
+    @staticmethod
+    def _snapshot(event: Event) -> tuple:
+        participants = {p.id: services._get_participant_result_state(participant=p) for p in event.participant.all()}
+        routes = {r.id: r.score_json for r in event.route.all()}
+        return participants, routes
+
+    def test_numpy_engine_matches_python_engine_on_mock_data(self):
+        for score_type in (Event.SCORE_SIMPLE_SUM, Event.SCORE_PROPORTIONAL, Event.SCORE_GRADE,
+                           Event.SCORE_NUM_ACCENTS, Event.SCORE_FRENCH):
+            with self.subTest(score_type=score_type):
+                event = services.create_event(owner=self.superuser, title="Engine Event", date=datetime(2026, 10, 1))
+                event.score_type = score_type
+                event.count_routes_num = 5
+                event.flash_points_pc = 33
+                event.group_num = 2
+                event.group_list = "Group 0, Group 1"
+                event.save()
+                services.debug_create_participants(event=event, num=60)
+                with mock.patch.object(settings, 'SCORING_ENGINE', services.SCORING_ENGINE_PYTHON):
+                    services.debug_apply_random_results(event=event)
+                python_results = self._snapshot(event=event)
+
+                event.participant.update(score=0, scores={}, counted_routes=[], french_score=None, place=0)
+                event.route.update(score_json={'all': 1})
+                with mock.patch.object(settings, 'SCORING_ENGINE', services.SCORING_ENGINE_NUMPY):
+                    services.update_results(event=event)
+                self.assertEqual(python_results, self._snapshot(event=event))
+
+
+class ResultsSnapshotTestCase(ClimbingEventsBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = services.create_event(owner=self.superuser, title="Snapshot Event", date=datetime(2026, 10, 1))
+        self.event.is_published = True
+        self.event.save()
+        self.participant = Participant.objects.create(first_name='P', last_name='L', gender=Participant.GENDER_MALE,
+                                                      event=self.event, pin=5000)
+
+    def _get_snapshot(self) -> dict:
+        return services.get_results_snapshot(event=Event.objects.get(id=self.event.id))
+
+    def _get_male_scores(self) -> list:
+        return [item['score'] for item in self._get_snapshot()['results'][Participant.GENDER_MALE][0]['data']]
+
+    def test_snapshot_is_served_from_cache(self):
+        self._get_snapshot()
+        event = Event.objects.get(id=self.event.id)
+        with self.assertNumQueries(0):
+            services.get_results_snapshot(event=event)
+
+    def test_snapshot_invalidated_on_results_change(self):
+        self.assertEqual(self._get_male_scores(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enter_results(event=self.event, participant=self.participant, accents={0: {'top': 1, 'zone': 1}})
+        self.participant.refresh_from_db()
+        self.assertGreater(self.participant.score, 0)
+        self.assertEqual(self._get_male_scores(), [self.participant.score])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.clear_results(event=self.event)
+        self.assertEqual(self._get_male_scores(), [])
+
+    def test_results_version_written_once_per_operation(self):
+        with CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+            services.enter_results(event=self.event, participant=self.participant, accents={0: {'top': 1, 'zone': 1}})
+        # сохранение участника и пересчёт группы - одна новая версия после commit
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE "events_event"')]), 1)
+
+    def test_snapshot_invalidated_on_event_and_route_edit(self):
+        version = Event.objects.get(id=self.event.id).results_version
+        self.event.is_count_only_entered_results = False
+        self.event.save()
+        self.assertEqual(self._get_male_scores(), [0])
+        self.assertNotEqual(Event.objects.get(id=self.event.id).results_version, version)
+
+        version = Event.objects.get(id=self.event.id).results_version
+        route = self.event.route.get(number=1)
+        route.grade = '7A'
+        with self.captureOnCommitCallbacks(execute=True):
+            route.save()
+        self.assertEqual(self._get_snapshot()['routes'][0]['grade'], '7A')
+        self.assertNotEqual(Event.objects.get(id=self.event.id).results_version, version)
+
+    def test_snapshot_replaces_previous_version(self):
+        old_version = Event.objects.get(id=self.event.id).results_version
+        self._get_snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enter_results(event=self.event, participant=self.participant, accents={0: {'top': 1, 'zone': 1}})
+        snapshot = self._get_snapshot()
+        # один ключ на соревнование: от предыдущего снимка остаются только строки для ?since
+        self.assertEqual(snapshot, cache.get(services._get_results_snapshot_key(event_id=self.event.id)))
+        self.assertEqual(snapshot['previous']['version'], old_version)
+        self.assertEqual(snapshot['previous']['rows'], {})
+        self.assertIsInstance(snapshot['results'][Participant.GENDER_MALE][0]['data'][0], dict)
+
+    def test_table_version_changes_only_for_changed_group(self):
+        Participant.objects.create(first_name='F', last_name='L', gender=Participant.GENDER_FEMALE,
+                                   event=self.event, pin=5001, is_entered_result=True)
+        results = self._get_snapshot()['results']
+        male, female = results[Participant.GENDER_MALE][0]['version'], results[Participant.GENDER_FEMALE][0]['version']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enter_results(event=self.event, participant=self.participant, accents={0: {'top': 1, 'zone': 1}})
+        results = self._get_snapshot()['results']
+        self.assertNotEqual(results[Participant.GENDER_MALE][0]['version'], male)
+        self.assertEqual(results[Participant.GENDER_FEMALE][0]['version'], female)
+
+        Event.objects.filter(id=self.event.id).update(is_results_allowed=True)
+        response = self.client.get(reverse('results', args=[self.event.id]))
+        self.assertContains(response, f'data-participant="{self.participant.id}"')
+
+
+class LiveResultsTestCase(ClimbingEventsBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = services.create_event(owner=self.superuser, title="Live Event", date=datetime(2026, 10, 1))
+        self.event.is_published = True
+        self.event.is_results_allowed = True
+        self.event.save()
+        self.participants = [Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}',
+                                                        gender=Participant.GENDER_MALE, event=self.event,
+                                                        pin=7000 + i) for i in range(3)]
+        for participant in self.participants:
+            services.enter_results(event=self.event, participant=participant, accents={0: {'top': 2, 'zone': 1}})
+
+    def _get_state(self) -> dict:
+        return services.get_results_live_state(event=Event.objects.get(id=self.event.id))
+
+    def test_delta_contains_only_changed_rows(self):
+        state = self._get_state()
+        self.assertIsNone(live._get_delta(old=state, new=self._get_state()))
+
+        leader = self.participants[2]
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enter_results(event=self.event, participant=leader, accents={0: {'top': 1, 'zone': 1}})
+        delta = live._get_delta(old=state, new=self._get_state())
+        self.assertEqual(delta['removed'], [])
+        rows = {row['id']: row for row in delta['rows']}
+        self.assertIn(leader.id, rows)
+        self.assertEqual(rows[leader.id]['place'], 1)
+        self.assertEqual(rows[leader.id]['order'], 0)
+
+    def test_delta_requests_reload_on_layout_change(self):
+        state = self._get_state()
+        self.event.is_view_full_results = False
+        self.event.save()
+        self.assertEqual(live._get_delta(old=state, new=self._get_state()), {'reload': True})
+
+    def test_notify_sent_once_per_transaction_only_with_live_push(self):
+        def count_notifies(live_push: bool) -> int:
+            with mock.patch.object(settings, 'RESULTS_LIVE_PUSH', live_push), \
+                    CaptureQueriesContext(connection) as ctx, self.captureOnCommitCallbacks(execute=True):
+                services.enter_results(event=self.event, participant=self.participants[0],
+                                       accents={0: {'top': 1, 'zone': 1}})
+                services.update_results(event=self.event)
+            return len([q for q in ctx.captured_queries if 'pg_notify' in q['sql']])
+
+        self.assertEqual(count_notifies(live_push=False), 0)
+        self.assertEqual(count_notifies(live_push=True), 1 if connection.vendor == 'postgresql' else 0)
+
+    def test_stream_disabled_by_default(self):
+        url = reverse('results_stream', kwargs={'event_id': self.event.id})
+        with mock.patch.object(settings, 'RESULTS_LIVE_PUSH', False):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'EXPLAIN проверяется на PostgreSQL')
+class IndexUsageTests(ClimbingEventsBaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.event = services.create_event(owner=self.superuser, title="Index Event", date=datetime(2026, 10, 1))
+        PromoCode.objects.create(event=self.event, title='PROMO')
+        services.debug_create_participants(event=self.event, num=10)
+        # на маленьких таблицах планировщик выбирает seq scan, запрещаем его для проверки
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, queryset.explain())
+
+    def test_participant_lookups_use_indexes(self):
+        self.assertUsesIndex(self.event.participant.filter(gender=Participant.GENDER_MALE, group_index=0),
+                             'participant_ranking_idx')
+        self.assertUsesIndex(self.event.participant.filter(set_index=0), 'participant_event_set_idx')
+        self.assertUsesIndex(Participant.objects.filter(pin=1234, event__id=self.event.id),
+                             'unique_participant_pin_per_event')
+
+    def test_route_and_promo_code_lookups_use_indexes(self):
+        self.assertUsesIndex(self.event.route.all().order_by('number'), 'unique_route_number_per_event')
+        self.assertUsesIndex(PromoCode.objects.filter(title='PROMO', event__id=self.event.id),
+                             'promocode_event_title_idx')
+
 
 class FormsTestCase(ClimbingEventsBaseTestCase):
     def test_participant_registration_form_fields(self):
@@ -430,6 +1025,56 @@ class ViewsTestCase(ClimbingEventsBaseTestCase):
         self.assertTrue(p.is_entered_result)
         self.assertEqual(p.french_accents.get("0"), {"top": 1, "zone": 1})
 
+    def test_enter_wo_reg_view_full_event(self):
+        self.event.is_premium = False
+        self.event.max_participants = 1
+        self.event.is_enter_result_allowed = True
+        self.event.save()
+        Participant.objects.create(first_name='Первый', last_name='Участник', gender=Participant.GENDER_MALE,
+                                   event=self.event, pin=5556)
+        url = reverse('enter_wo_reg', kwargs={'event_id': self.event.id})
+        post_data = {
+            'first_name': 'Второй',
+            'last_name': 'Участник',
+            'gender': Participant.GENDER_MALE,
+            'birth_year': 1990,
+            'city': 'Москва',
+            'team': 'Скала',
+            'grade': Participant.GRADE_BR,
+            'email': 'second@example.com',
+            'phone_number': '+79998887766',
+            'accents-TOTAL_FORMS': '10',
+            'accents-INITIAL_FORMS': '10',
+            'accents-MIN_NUM_FORMS': '0',
+            'accents-MAX_NUM_FORMS': '1000',
+        }
+        for i in range(10):
+            post_data[f'accents-{i}-label'] = str(i)
+            post_data[f'accents-{i}-top'] = '1' if i == 0 else '0'
+            post_data[f'accents-{i}-zone'] = '1' if i == 0 else '0'
+
+        response = self.client.post(url, data=post_data, follow=True)
+        self.assertEqual(response.redirect_chain[0][0], url)
+        self.assertContains(response, str(RegistrationFullError()))
+        self.assertFalse(self.event.participant.filter(first_name='Второй').exists())
+
+    def test_results_view_conditional_get(self):
+        p = Participant.objects.create(first_name='A', last_name='B', gender=Participant.GENDER_MALE,
+                                       event=self.event, pin=6666)
+        url = reverse('results', kwargs={'event_id': self.event.id}) + '?autorefresh'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enter_results(event=self.event, participant=p, accents={0: {'top': 1, 'zone': 1}})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
 
 class APITestCase(ClimbingEventsBaseTestCase):
     def test_jwt_token_obtain_and_refresh(self):
@@ -500,6 +1145,61 @@ class APITestCase(ClimbingEventsBaseTestCase):
         new_event = Event.objects.get(title='Authorized Event')
         self.assertEqual(Route.objects.filter(event=new_event).count(), 10)
 
+    def test_event_results_api_since_version(self):
+        event = services.create_event(owner=self.superuser, title="Results API Event", date=date(2026, 10, 1))
+        event.is_published = True
+        event.is_results_allowed = True
+        event.save()
+        participants = [Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}',
+                                                   gender=Participant.GENDER_FEMALE, event=event, pin=8000 + i)
+                        for i in range(3)]
+        for participant in participants:
+            services.enter_results(event=event, participant=participant, accents={0: {'top': 2, 'zone': 1}})
+
+        url = reverse('api_events-results', kwargs={'pk': event.id})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['full'])
+        rows = response.json()['results'][Participant.GENDER_FEMALE][0]['data']
+        self.assertEqual([row['place'] for row in rows], [1, 1, 1])
+        version = response.json()['version']
+
+        response = self.client.get(url, {'since': version})
+        self.assertFalse(response.json()['full'])
+        self.assertEqual(response.json()['changed'], [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            services.enter_results(event=event, participant=participants[1], accents={0: {'top': 1, 'zone': 1}})
+        response = self.client.get(url, {'since': version})
+        self.assertFalse(response.json()['full'])
+        changed = {row['id']: row for row in response.json()['changed']}
+        self.assertEqual(changed[participants[1].id]['place'], 1)
+        self.assertEqual(changed[participants[0].id]['place'], 2)
+        self.assertEqual(response.json()['removed'], [])
+
+        # неизвестная версия - полный ответ
+        response = self.client.get(url, {'since': 'unknown'})
+        self.assertTrue(response.json()['full'])
+
+    def test_routes_api_list_conditional_get(self):
+        event = services.create_event(owner=self.superuser, title="ETag Event", date=date(2026, 10, 1))
+        event.is_published = True
+        event.save()
+        url = reverse('api_routes-list') + f'?event={event.id}'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        route = event.route.get(number=1)
+        route.color = '#00FF00'
+        with self.captureOnCommitCallbacks(execute=True):
+            route.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
     def test_participants_api_registration_and_results(self):
         event = services.create_event(owner=self.superuser, title="API Reg Event", date=date(2026, 10, 1))
         event.is_published = True
@@ -543,6 +1243,14 @@ class APITestCase(ClimbingEventsBaseTestCase):
         self.assertTrue(participant.is_entered_result)
         self.assertEqual(participant.french_accents.get("0"), {"top": 1, "zone": 1})
 
+        # номер трассы вне 0..routes_num - 1 - ошибка запроса, прохождения не меняются
+        for accents in ({"100000000": "T"}, {"-1": {"top": 1, "zone": 1}}, {"10": {"top": 1, "zone": 1}}):
+            response_enter = self.client.post(url_enter, data={'pin': pin, 'accents': accents},
+                                              content_type='application/json')
+            self.assertEqual(response_enter.status_code, 400)
+        participant.refresh_from_db()
+        self.assertEqual(participant.french_accents, accents_data['accents'])
+
 
 class ProtocolAsyncTests(TransactionTestCase):
     def setUp(self):
@@ -565,11 +1273,15 @@ class ProtocolAsyncTests(TransactionTestCase):
         url = reverse('async_get_results', args=[event.id])
         response = self.client.get(url)
         self.assertEqual(response.status_code, 302)
+        # повторный запрос присоединяется к ожидающему заданию
+        self.client.get(url)
+        self.assertEqual(event.protocol_job.filter(status=ProtocolJob.STATUS_PENDING).count(), 1)
 
-        import threading
-        threads = [t for t in threading.enumerate() if t.name == f"export_results_{event.id}"]
-        for t in threads:
-            t.join(timeout=5)
+        from django.core.management import call_command
+        call_command('protocol_worker', once=True)
+        job = event.protocol_job.get()
+        self.assertEqual(job.status, ProtocolJob.STATUS_DONE)
+        self.assertEqual(job.progress, 100)
 
         protocols = services.get_list_of_protocols(event)
         self.assertGreater(len(protocols), 0)
@@ -579,6 +1291,116 @@ class ProtocolAsyncTests(TransactionTestCase):
         for item in protocols:
             services.remove_file(f"{event.id}/{item['name']}")
 
+    def test_failed_protocol_job_is_retried(self):
+        event = services.create_event(owner=self.superuser, title="Retry Event", date=date(2026, 10, 1))
+        job = services.enqueue_protocol_job(event=event)
+        with mock.patch('events.xl_tools.export_result', side_effect=OSError('disk full')):
+            services.run_protocol_job(job=services.claim_protocol_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ProtocolJob.STATUS_PENDING)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.error, 'disk full')
+        # повтор не раньше паузы
+        self.assertIsNone(services.claim_protocol_job())
+
+        job.attempts = services.PROTOCOL_JOB_MAX_ATTEMPTS - 1
+        job.run_after = job.created
+        job.save()
+        with mock.patch('events.xl_tools.export_result', side_effect=OSError('disk full')):
+            services.run_protocol_job(job=services.claim_protocol_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, ProtocolJob.STATUS_FAILED)
+
+
+class RegistrationCapacityTests(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.superuser = CustomUser.objects.create_superuser(
+            id=1,
+            username='admin',
+            email='admin@example.com',
+            password='password123',
+            premium_price=100
+        )
+        self.event = services.create_event(owner=self.superuser, title="Capacity Event", date=date(2026, 10, 1))
+        self.event.is_published = True
+        self.event.is_registration_open = True
+        self.event.set_num = 2
+        self.event.set_list = "Сет 1, Сет 2"
+        self.event.set_max_participants = 1
+        self.event.save()
+
+    def _register(self, last_name: str, set_name: str = "Сет 1") -> Participant:
+        return services.register_participant(event=self.event, cd={'first_name': 'Имя', 'last_name': last_name,
+                                                                   'set_index': set_name})
+
+    def test_full_set_raises(self):
+        self._register(last_name='Первый')
+        with self.assertRaises(RegistrationFullError):
+            self._register(last_name='Второй')
+        self._register(last_name='Третий', set_name="Сет 2")
+        self.event.refresh_from_db()
+        self.assertFalse(self.event.is_registration_open)
+
+    def test_concurrent_registrations_do_not_oversubscribe_set(self):
+        import threading
+        from django.db import close_old_connections
+        errors = []
+        barrier = threading.Barrier(4)
+
+        def register(index: int):
+            try:
+                barrier.wait()
+                self._register(last_name=f'Участник{index}')
+            except RegistrationFullError as e:
+                errors.append(e)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=register, args=(i,)) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join(timeout=10)
+        self.assertEqual(self.event.participant.filter(set_index=0).count(), 1)
+        self.assertEqual(len(errors), 3)
+
+
+class DebouncedResultsTests(TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.superuser = CustomUser.objects.create_superuser(
+            id=1,
+            username='admin',
+            email='admin@example.com',
+            password='password123',
+            premium_price=100
+        )
+        self.event = services.create_event(owner=self.superuser, title="Debounce Event", date=date(2026, 10, 1))
+        for i in range(4):
+            Participant.objects.create(first_name=f'P{i}', last_name=f'L{i}', gender=Participant.GENDER_MALE,
+                                       event=self.event, pin=3000 + i)
+        services.update_results(event=self.event)
+
+    def test_burst_of_results_is_recomputed_once(self):
+        cards = [{0: {'top': 1, 'zone': 1}}, {0: {'top': 2, 'zone': 1}, 1: {'top': 1, 'zone': 1}}, {}]
+        with mock.patch.object(settings, 'RESULTS_RECOMPUTE_DEBOUNCE', 0.5), \
+                mock.patch.object(settings, 'RESULTS_INCREMENTAL_UPDATE', False), \
+                mock.patch.object(services, '_update_results', wraps=services._update_results) as update_results:
+            for participant, card in zip(self.event.participant.order_by('pin'), cards):
+                services.enter_results(event=self.event, participant=participant, accents=card)
+            # свой результат виден сразу
+            self.assertGreater(self.event.participant.get(pin=3000).score, 0)
+            timers = list(services._scheduled_updates.values())
+            self.assertEqual(len(timers), 1)
+            for timer in timers:
+                timer.join()
+        self.assertEqual(update_results.call_count, 1)
+
+        debounced = {p.id: (p.score, p.place) for p in self.event.participant.all()}
+        services.update_results(event=self.event)
+        self.assertEqual(debounced, {p.id: (p.score, p.place) for p in self.event.participant.all()})
+
 
 class MultiDayEventTests(TestCase):
     def setUp(self):
@@ -37,6 +37,7 @@ urlpatterns = [
     path('e/<int:event_id>/enter_check/', views.EnterCheckView.as_view(), name='enter_check'),
     path('e/<int:event_id>/enter_wo_reg/', views.EnterWithoutReg.as_view(), name='enter_wo_reg'),
     path('e/<int:event_id>/results/', views.ResultsView.as_view(), name='results'),
+    path('e/<int:event_id>/results/stream/', views.results_stream, name='results_stream'),
     path('e/<int:event_id>/participants/', views.ParticipantsView.as_view(), name='participants'),
     path('e/<int:event_id>/registration/', views.RegistrationView.as_view(), name='registration'),
     path('e/<int:event_id>/registration_ok/<int:participant_id>', views.EventRegistrationOkView.as_view(),
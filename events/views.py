@@ -2,26 +2,27 @@ import asyncio
 import datetime
 import json
 import logging
-import operator
 
 from asgiref.sync import sync_to_async
 from django import views
+from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.mail import send_mail
 from django.core.paginator import Paginator
-from django.db.models import Count, Q
+from django.db.models import Q
 from django.forms import formset_factory, modelformset_factory, ModelChoiceField
-from django.http import HttpResponse, JsonResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, render, redirect
 from django.urls import reverse
+from django.views.decorators.http import condition
 
 from config import settings
-from events.exceptions import DuplicateParticipantError, ParticipantTooYoungError
+from events.exceptions import DuplicateParticipantError, ParticipantTooYoungError, RegistrationFullError
 from events.forms import AccentFrenchForm, EventPremiumSettingsForm, ParticipantRegistrationForm, AdminDescriptionForm, AccentForm, AccentParticipantForm, \
     EventSettingsForm, RouteEditForm, ParticipantForm, CreateEventForm, EventPaySettingsForm, \
     PromoCodeAddForm, WalletForm, ScoreTableForm
 from events.models import GRADES, Event, Participant, PayDetail, Route, ACCENT_NO, PromoCode, Wallet
-from events import services, xl_tools
+from events import live, services
 from braces import views as braces
 
 from events.pay_views import get_notify_link
@@ -88,15 +89,14 @@ class AdminActionsView(IsOwnerMixin, views.View):
     @staticmethod
     def get(request, event_id):
         event = get_object_or_404(Event, id=event_id)
-        entered_num = event.participant.filter(is_entered_result=True).count()
-        paid_num = event.participant.filter(paid=True).count()
+        counters = services.get_participant_counters(event=event)
         return render(
             request=request,
             template_name='events/event/admin-actions.html',
             context={
                 'event': event,
-                'entered_num': entered_num,
-                'paid_num': paid_num,
+                'entered_num': counters['entered'],
+                'paid_num': counters['paid'],
                 'male_link': str(request.build_absolute_uri(reverse('results', args=(event_id,)))) + '?autorefresh&m',
                 'female_link': str(request.build_absolute_uri(reverse('results', args=(event_id,)))) + '?autorefresh&f',
             }
@@ -121,26 +121,9 @@ class AdminActionsView(IsOwnerMixin, views.View):
         return redirect('admin_actions', event_id)
 
 
-def export_results_thread(event_id: int):
-    from django.db import close_old_connections
-    try:
-        event = get_object_or_404(Event, id=event_id)
-        xl_tools.export_result(event=event)
-    except Exception as e:
-        logger.error(f"Error exporting results for event {event_id}: {e}", exc_info=True)
-    finally:
-        close_old_connections()
-
-
 def async_get_results(request, event_id):
-    import threading
-    thread = threading.Thread(
-        target=export_results_thread,
-        args=(event_id,),
-        name=f"export_results_{event_id}",
-        daemon=True
-    )
-    thread.start()
+    event = get_object_or_404(Event, id=event_id)
+    services.enqueue_protocol_job(event=event)
     return redirect('admin_protocols', event_id)
 
 
@@ -153,7 +136,8 @@ class AdminProtocolsView(IsOwnerMixin, views.View):
             template_name='events/event/admin-protocols.html',
             context={
                 'event': event,
-                'protocols': services.get_list_of_protocols(event=event)
+                'protocols': services.get_list_of_protocols(event=event),
+                'jobs': services.get_protocol_jobs(event=event),
             }
         )
 
@@ -517,7 +501,11 @@ class EnterWithoutReg(views.View):
                 if not event.is_update_result_allowed:
                     return redirect('results', event_id=event_id)
             except Participant.DoesNotExist:
-                participant = services.register_participant(event=event, cd=form.cleaned_data)
+                try:
+                    participant = services.register_participant(event=event, cd=form.cleaned_data)
+                except (DuplicateParticipantError, ParticipantTooYoungError, RegistrationFullError) as e:
+                    messages.error(request, str(e))
+                    return redirect('enter_wo_reg', event_id=event_id)
             services.enter_results(event=event,
                                    participant=participant,
                                    accents=services.form_data_to_results(form_cleaned_data=accent_formset.cleaned_data))
@@ -527,57 +515,59 @@ class EnterWithoutReg(views.View):
 
 class ResultsView(views.View):
     @staticmethod
+    @condition(etag_func=services.get_results_etag)
     def get(request, event_id):
         event = get_object_or_404(Event, id=event_id)
-        results = services.get_results(event=event, full_results=True)
+        snapshot = services.get_results_snapshot(event=event)
+        results = snapshot['results']
         return render(
             request=request,
             template_name='events/event/results.html',
             context={
                 'event': event,
-                'routes': event.route.all().order_by('number'),
+                'routes': snapshot['routes'],
                 'male': results[Participant.GENDER_MALE],
                 'female': results[Participant.GENDER_FEMALE],
                 'view_scores': event.is_view_full_results and event.is_view_route_score and event.score_type != Event.SCORE_NUM_ACCENTS and event.score_type != Event.SCORE_FRENCH,
                 'autorefresh': 'autorefresh' in request.GET,
+                'live_push': settings.RESULTS_LIVE_PUSH,
                 'active_male': 'm' in request.GET or 'f' not in request.GET,
                 'active_female': 'f' in request.GET,
+                'is_owner': request.user == event.owner or request.user.is_superuser,
             }
         )
 
 
+async def results_stream(request, event_id):
+    """ SSE-поток изменений результатов для ?autorefresh (RESULTS_LIVE_PUSH), обслуживается через config.asgi """
+    event = await Event.objects.filter(id=event_id).afirst()
+    if not settings.RESULTS_LIVE_PUSH or event is None:
+        raise Http404
+    user = await request.auser()
+    if not (event.is_published or user.is_superuser or user.id == event.owner_id) or not event.is_results_allowed:
+        raise Http404
+    response = StreamingHttpResponse(live.results_stream(event_id=event.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 class ParticipantsView(views.View):
     @staticmethod
+    @condition(etag_func=services.get_results_etag)
     def get(request, event_id):
         event = get_object_or_404(Event, id=event_id)
-        queryset = Participant.objects.filter(event__id=event_id)
-        participants = sorted(queryset, key=operator.attrgetter('last_name'))
-        set_list = services.get_set_list(event=event)
-        chart_set_data = {
-            'labels': set_list,
-            'data': [event.participant.filter(set_index=index).count() for index in range(len(set_list))],
-        }
-        group_list = services.get_group_list(event=event)
-        chart_group_data = {
-            'labels': group_list,
-            'data': [event.participant.filter(group_index=index).count() for index in range(len(group_list))],
-        }
-        cities = Participant.objects.filter(event__id=event_id).values('city').order_by('-city').annotate(
-            num=Count('city'))
-        cities = sorted(cities, key=operator.itemgetter('num'), reverse=True)
-        chart_city_data = {
-            'labels': [str(city['city']) for city in cities],
-            'data': [city['num'] for city in cities],
-        }
+        participants = event.participant.order_by('last_name')
+        charts = services.get_participants_charts(event=event)
         return render(
             request=request,
             template_name='events/event/participants.html',
             context={
                 'event': event,
                 'participants': participants,
-                'chart_set_data': json.dumps(chart_set_data),
-                'chart_group_data': json.dumps(chart_group_data),
-                'chart_city_data': json.dumps(chart_city_data),
+                'chart_set_data': json.dumps(charts['set']),
+                'chart_group_data': json.dumps(charts['group']),
+                'chart_city_data': json.dumps(charts['city']),
                 'fields': services.get_registration_fields(event=event),
             }
         )
@@ -631,7 +621,7 @@ class RegistrationView(views.View):
                     return redirect('event_registration_ok', event_id=event_id, participant_id=participant.id)
                 else:
                     return redirect('participants', event_id=event_id)
-            except (DuplicateParticipantError, ParticipantTooYoungError) as e:
+            except (DuplicateParticipantError, ParticipantTooYoungError, RegistrationFullError) as e:
                 error = e
         return render(
             request=request,
@@ -703,10 +693,14 @@ class RouteEditor(IsOwnerMixin, views.View):
         score_table_formset = ScoreTableFormset(request.POST, prefix='score')
         if formset.is_valid():
             routes = event.route.all().order_by('number')
+            is_grades_changed = False
             for index, route in enumerate(routes):
+                is_grades_changed |= route.grade != formset.cleaned_data[index]['grade']
                 route.grade = formset.cleaned_data[index]['grade']
                 route.color = formset.cleaned_data[index]['color']
                 route.save()
+            if is_grades_changed and event.score_type == Event.SCORE_GRADE:
+                services.update_results(event=event)
         if score_table_formset.is_valid():
             score_table = {GRADES[i][0]: score_table_formset.cleaned_data[i]['score'] for i in range(len(GRADES))}
             if score_table != event.score_table:
@@ -886,10 +880,11 @@ def check_pin_code(request):
                         'reason': f'Найден участник: {participant.last_name} {participant.first_name}, но повторный ввод результатов запрещён.'}
         else:
             response = {'result': True, 'participant': f'{participant.last_name} {participant.first_name}'}
+            accents = services.get_participant_accents_json(participant=participant, routes_num=event.routes_num)
             if event.score_type == Event.SCORE_FRENCH:
-                response.update({'french_accents': participant.french_accents})
+                response.update({'french_accents': accents})
             else:
-                response.update({'accents': participant.french_accents})
+                response.update({'accents': accents})
 
     except Participant.DoesNotExist:
         response = {'result': False,
@@ -1,8 +1,12 @@
-import operator
 import os
+from copy import copy
 from datetime import datetime
+from itertools import chain
+from typing import Callable, Iterable
 
 from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.worksheet.worksheet import Worksheet
 from io import BytesIO
 
 def save_virtual_workbook(workbook):
@@ -23,85 +27,177 @@ def load_template(filename: str) -> Workbook or None:
         return None
 
 
-def export_participants_to_start_list(event: Event):
-    ROW_OFFSET = 8
-    book = load_workbook(filename='static/events/xl_templates/startlist_template.xlsx')
+START_LIST_TEMPLATE = 'static/events/xl_templates/startlist_template.xlsx'
+RESULT_TEMPLATE = 'static/events/xl_templates/result_template.xlsx'
+
+
+def _load_event_template(filename: str, event: Event) -> Workbook:
+    book = load_workbook(filename=filename)
     sheet = book.active
     sheet.cell(row=1, column=1).value = event.gym
     sheet.cell(row=2, column=1).value = event.title
     sheet.merge_cells(start_row=3, start_column=6, end_row=3, end_column=8)
     sheet.cell(row=3, column=6).value = event.date_display
+    return book
+
+
+def _copy_template_cell(sheet, cell, value) -> WriteOnlyCell:
+    new_cell = WriteOnlyCell(sheet, value=value)
+    if cell.has_style:
+        new_cell.font = copy(cell.font)
+        new_cell.fill = copy(cell.fill)
+        new_cell.border = copy(cell.border)
+        new_cell.alignment = copy(cell.alignment)
+        new_cell.number_format = cell.number_format
+    return new_cell
+
+
+def _add_sheet(book: Workbook, template: Worksheet, title: str, head: dict, rows: Iterable, row_offset: int) -> None:
+    """ Лист по шаблону template: в шапке (строки до row_offset) значения head {(row, column): value},
+    с row_offset строки rows. В write-only книге шапка с оформлением копируется из шаблона,
+    а строки пишутся сразу на диск по мере получения, не накапливаясь в памяти """
+    if not book.write_only:
+        sheet = book.copy_worksheet(template)
+        sheet.title = title
+        for (row, column), value in head.items():
+            sheet.cell(row=row, column=column).value = value
+        for index, values in enumerate(rows):
+            for column, value in enumerate(values, start=1):
+                sheet.cell(row=row_offset + index, column=column).value = value
+        return
+
+    sheet = book.create_sheet(title=title)
+    for letter, dimension in template.column_dimensions.items():
+        sheet.column_dimensions[letter].width = dimension.width
+    for row, dimension in template.row_dimensions.items():
+        if dimension.height:
+            sheet.row_dimensions[row].height = dimension.height
+    for merged in template.merged_cells.ranges:
+        sheet.merged_cells.add(merged.coord)
+    columns = max([template.max_column] + [column for _, column in head])
+    for row in range(1, row_offset):
+        cells = (template.cell(row=row, column=column) for column in range(1, columns + 1))
+        sheet.append([_copy_template_cell(sheet, cell, head.get((cell.row, cell.column), cell.value))
+                      for cell in cells])
+    for values in rows:
+        sheet.append(values)
+
+
+def _create_book(template: Workbook, write_only: bool) -> Workbook:
+    return Workbook(write_only=True) if write_only else template
+
+
+def _close_book(book: Workbook, template: Workbook) -> None:
+    if book is template:
+        book.remove(book.worksheets[0])
+    template.close()
+
+
+def _get_start_list_rows(participants: Iterable, group_list: list, reg_type_list: list) -> Iterable:
+    for index, p in enumerate(participants):
+        yield [
+            index + 1,
+            f'{p.last_name} {p.first_name}',
+            p.birth_year,
+            p.get_gender_display(),
+            p.city,
+            p.get_grade_display(),
+            p.team,
+            group_list[p.group_index] if group_list != [] else '',
+            p.pin,
+            str(p.phone_number),
+            p.email,
+            "Да" if p.paid else "-",
+            reg_type_list[p.reg_type_index].strip() if reg_type_list != [] else '',
+        ]
+
+
+def export_participants_to_start_list(event: Event, write_only: bool = None):
+    ROW_OFFSET = 8
+    if write_only is None:
+        write_only = settings.XLSX_WRITE_ONLY_EXPORT
+    template = _load_event_template(filename=START_LIST_TEMPLATE, event=event)
+    book = _create_book(template=template, write_only=write_only)
 
     group_list = services.get_group_list(event=event)
     reg_type_list = event.reg_type_list.split(',') if event.reg_type_num > 1 else []
 
     for set_no in range(event.set_num):
-        sheet = book.copy_worksheet(book.worksheets[0])
-        sheet.title = f'Сет {set_no + 1}'
-        sheet.cell(row=5, column=1).value = sheet.title
-        queryset = event.participant.filter(set_index=set_no)
-        participants = sorted(queryset, key=operator.attrgetter('last_name'))
-        for index, p in enumerate(participants):
-            sheet.cell(row=ROW_OFFSET + index, column=1).value = index + 1
-            sheet.cell(row=ROW_OFFSET + index, column=2).value = f'{p.last_name} {p.first_name}'
-            sheet.cell(row=ROW_OFFSET + index, column=3).value = p.birth_year
-            sheet.cell(row=ROW_OFFSET + index, column=4).value = p.get_gender_display()
-            sheet.cell(row=ROW_OFFSET + index, column=5).value = p.city
-            sheet.cell(row=ROW_OFFSET + index, column=6).value = p.get_grade_display()
-            sheet.cell(row=ROW_OFFSET + index, column=7).value = p.team
-            sheet.cell(row=ROW_OFFSET + index, column=8).value = group_list[p.group_index] if group_list != [] else ''
-            sheet.cell(row=ROW_OFFSET + index, column=9).value = p.pin
-            sheet.cell(row=ROW_OFFSET + index, column=10).value = str(p.phone_number)
-            sheet.cell(row=ROW_OFFSET + index, column=11).value = p.email
-            sheet.cell(row=ROW_OFFSET + index, column=12).value = "Да" if p.paid else "-"
-            sheet.cell(row=ROW_OFFSET + index, column=13).value = reg_type_list[p.reg_type_index].strip() if reg_type_list != [] else ''
-    book.remove(book.worksheets[0])
-    book.close()
+        title = f'Сет {set_no + 1}'
+        participants = event.participant.filter(set_index=set_no).order_by('last_name').iterator()
+        _add_sheet(book=book, template=template.worksheets[0], title=title, head={(5, 1): title},
+                   rows=_get_start_list_rows(participants=participants, group_list=group_list,
+                                             reg_type_list=reg_type_list),
+                   row_offset=ROW_OFFSET)
+    _close_book(book=book, template=template)
 
     return save_virtual_workbook(book)
 
 
-def export_result(event: Event):
-    ROW_OFFSET = 9
-    HEADS_ROW = 8
-    book = load_workbook(filename='static/events/xl_templates/result_template.xlsx')
-    sheet = book.active
-    sheet.cell(row=1, column=1).value = event.gym
-    sheet.cell(row=2, column=1).value = event.title
-    sheet.merge_cells(start_row=3, start_column=6, end_row=3, end_column=8)
-    sheet.cell(row=3, column=6).value = event.date_display
+RESULT_HEADS_ROW = 8
+
+
+def _get_result_head(event: Event, routes: list, scores: list, routes_num: int) -> dict:
+    head = {}
+    for num in range(routes_num):
+        head[(RESULT_HEADS_ROW, 8 + num)] = f"T#{num + 1}"
+        if event.is_view_route_grade:
+            head[(RESULT_HEADS_ROW - 1, 8 + num)] = routes[num].grade
+        if event.score_type != Event.SCORE_NUM_ACCENTS:
+            head[(RESULT_HEADS_ROW - 2, 8 + num)] = scores[num].replace('\n', '/')
+    head[(RESULT_HEADS_ROW, 8 + routes_num)] = "Итог"
+    return head
+
+
+def _get_result_rows(participants: Iterable) -> Iterable:
+    for p in participants:
+        participant = p['participant']
+        yield [
+            participant.place,
+            f"{participant.last_name} {participant.first_name}",
+            participant.birth_year,
+            participant.city,
+            participant.get_grade_display(),
+            participant.team,
+            p['score_view'],
+            *p['accents'],
+            p['score_view'],
+        ]
+
+
+def write_result_book(event: Event, result: dict, routes: list, write_only: bool = None,
+                      on_progress: Callable = None) -> Workbook:
+    """ Книга протокола результатов по данным services.get_results(full_results=True)
+    или services.get_results_stream(): data группы может быть генератором, строки пишутся по мере чтения.
+    on_progress(percent) вызывается после каждого листа """
+    if write_only is None:
+        write_only = settings.XLSX_WRITE_ONLY_EXPORT
+    template = _load_event_template(filename=RESULT_TEMPLATE, event=event)
+    book = _create_book(template=template, write_only=write_only)
+
+    groups = [(gender, group) for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE)
+              for group in result[gender]]
+    for done, (gender, group) in enumerate(groups, start=1):
+        participants = iter(group['data'])
+        first = next(participants, None)
+        head = _get_result_head(event=event, routes=routes, scores=group['scores'],
+                                routes_num=len(first['accents'])) if first else {}
+        participants = chain([first], participants) if first else []
+        _add_sheet(book=book, template=template.worksheets[0], title=f"{group['name']}_{gender}", head=head,
+                   rows=_get_result_rows(participants=participants), row_offset=RESULT_HEADS_ROW + 1)
+        if on_progress:
+            on_progress(100 * done // len(groups))
+    _close_book(book=book, template=template)
+    return book
+
+
+def export_result(event: Event, on_progress: Callable = None) -> str:
+    """ Сохраняет итоговый протокол в PROTOCOLS_PATH/<event.id>/, возвращает путь к файлу.
+    Участники читаются по группам потоком и сразу пишутся в write-only книгу """
+    result = services.get_results_stream(event=event)
+    routes = list(event.route.all().order_by('number'))
+    book = write_result_book(event=event, result=result, routes=routes, on_progress=on_progress)
 
-    result = services.get_results(event=event, full_results=True)
-    routes = event.route.all().order_by('number')
-
-    for gender in (Participant.GENDER_MALE, Participant.GENDER_FEMALE):
-        gender_data = result[gender]
-        for group_index, group in enumerate(gender_data):
-            participants = group['data']
-            scores = group['scores']
-            title = f"{group['name']}_{gender}"
-            sheet = book.copy_worksheet(book.worksheets[0])
-            sheet.title = title
-            for index, p in enumerate(participants):
-                sheet.cell(row=ROW_OFFSET + index, column=1).value = p['participant'].place
-                sheet.cell(row=ROW_OFFSET + index,
-                           column=2).value = f"{p['participant'].last_name} {p['participant'].first_name}"
-                sheet.cell(row=ROW_OFFSET + index, column=3).value = p['participant'].birth_year
-                sheet.cell(row=ROW_OFFSET + index, column=4).value = p['participant'].city
-                sheet.cell(row=ROW_OFFSET + index, column=5).value = p['participant'].get_grade_display()
-                sheet.cell(row=ROW_OFFSET + index, column=6).value = p['participant'].team
-                sheet.cell(row=ROW_OFFSET + index, column=7).value = p['score_view']
-                for num, accent in enumerate(p['accents']):
-                    sheet.cell(row=HEADS_ROW, column=8 + num).value = f"T#{num + 1}"
-                    if event.is_view_route_grade:
-                        sheet.cell(row=HEADS_ROW - 1, column=8 + num).value = routes[num].grade
-                    if event.score_type != Event.SCORE_NUM_ACCENTS:
-                        sheet.cell(row=HEADS_ROW - 2, column=8 + num).value = scores[num].replace('\n', '/')
-                    sheet.cell(row=ROW_OFFSET + index, column=8 + num).value = accent
-                sheet.cell(row=HEADS_ROW, column=8 + len(p['accents'])).value = "Итог"
-                sheet.cell(row=ROW_OFFSET + index, column=8 + len(p['accents'])).value = p['score_view']
-
-    book.remove(book.worksheets[0])
     if not os.path.exists(path=settings.PROTOCOLS_PATH):
         os.mkdir(settings.PROTOCOLS_PATH)
     path = os.path.join(settings.PROTOCOLS_PATH, f'{event.id}')
@@ -109,3 +205,4 @@ def export_result(event: Event):
         os.mkdir(path)
     file = os.path.join(path, f"results_{datetime.today().strftime('%Y-%m-%d-%H%M%S')}.xlsx")
     book.save(file)
+    return file